@@ -7,18 +7,12 @@ const SIGNALS = [
     { id: 4, name: 'West Signal' }
 ];
 
-function updateSignalDisplays() {
-    controller.signals.forEach((data, id) => {
-        updateSignalUI(id, data);
-    });
-}
-
 function loginUser() {
 
     if (localStorage.getItem('username')) return;
 
-    const username = prompt("Enter your username");
-    if (username === null || username === "") {
+    const username = prompt("Enter your username (letters, digits, _ and -)");
+    if (username === null || !/^[A-Za-z0-9_-]+$/.test(username)) {
         loginUser();
         return;
     }
@@ -39,37 +33,6 @@ function updateTrafficLights(card, status) {
 }
 
 
-// Simulation Control
-function toggleSimulation() {
-    const startButton = document.getElementById('startSimulation');
-    isSimulationRunning = !isSimulationRunning;
-    
-    if (isSimulationRunning) {
-        startButton.textContent = 'Stop Simulation';
-        startSimulation();
-    } else {
-        startButton.textContent = 'Start Simulation';
-        stopSimulation();
-    }
-}
-
-
-function startSimulation() {
-    currentSignalIndex = 0;
-    runSignalCycle();
-}
-
-function stopSimulation() {
-    clearInterval(simulationInterval);
-    clearTimeout(currentTimer);
-    
-    controller.signals.forEach((_, id) => {
-        controller.updateSignal(id, { status: 'Waiting' });
-    });
-    
-    updateSignalDisplays();
-}
-
 // State management
 class SignalController {
     constructor() {
@@ -100,17 +63,13 @@ class SignalController {
 }
 
 const controller = new SignalController();
-let isSimulationRunning = false;
-let currentSignalIndex = 0;
-let simulationInterval;
-let currentTimer;
 
 // Initialize application
 function initializeApp() {
     loginUser();
     createSignalCards();
     setupEventListeners();
-    fetchInitialData();
+    subscribeToSignals();
 }
 
 // Create signal cards
@@ -141,31 +100,43 @@ function createSignalCards() {
 
 // Event Listeners
 function setupEventListeners() {
-    const startButton = document.getElementById('startSimulation');
     const totalTimeInput = document.getElementById('totalTime');
+    const batchUploadInput = document.getElementById('batchUpload');
 
-    startButton.addEventListener('click', toggleSimulation);
+    batchUploadInput.addEventListener('change', handleBatchUpload);
     totalTimeInput.addEventListener('change', (e) => {
         controller.totalTime = parseInt(e.target.value);
         updateTimings();
     });
 }
-// API Calls
-async function fetchInitialData() {
-    try {
-        const response = await fetch(`${API_URL}/signals`);
-        const data = await response.json();
-        
-        Object.entries(data).forEach(([id, signalData]) => {
-            controller.updateSignal(parseInt(id), signalData);
+// Live signal state pushed by the server, a snapshot on connect and then only the fields that changed
+function subscribeToSignals() {
+    const query = SIGNALS.map(signal => `signal_id=${signal.id}`).join('&');
+    const events = new EventSource(`${API_URL}/signals/events?${query}`);
+
+    // EventSource reconnects by itself and the server starts every connection with a fresh snapshot
+    events.addEventListener('snapshot', (e) => applySignalChanges(JSON.parse(e.data).signals));
+    events.addEventListener('update', (e) => applySignalChanges(JSON.parse(e.data).signals));
+    events.onerror = () => console.error('Signal updates disconnected, reconnecting');
+}
+
+function applySignalChanges(changes) {
+    Object.entries(changes).forEach(([id, signal]) => {
+        const signalId = parseInt(id);
+        const data = {};
+        if (signal.vehicle_count !== undefined) data.vehicleCount = signal.vehicle_count;
+        if (signal.ambulance_count !== undefined) data.ambulanceDetected = signal.ambulance_count;
+        if (signal.timing !== undefined) data.timing = signal.timing;
+        if (signal.status) data.status = signal.status;  // the server runs the red/yellow/green cycle
+        controller.updateSignal(signalId, data);
+
+        updateSignalUI(signalId, {
+            ...controller.getSignal(signalId),
+            image: signal.image_version ? `${API_URL}/get-image/${signalId}?v=${signal.image_version}` : undefined
         });
-        
-        updateSignalDisplays();
-    } catch (error) {
-        console.error('Error fetching initial data:', error);
-        showError('Failed to fetch signal data');
-    }
+    });
 }
+
 // API Calls
 async function handleImageUpload(event, signalId) {
     const file = event.target.files[0];
@@ -176,7 +147,7 @@ async function handleImageUpload(event, signalId) {
     formData.append('username', localStorage.getItem('username'));
 
     try {
-        const response = await fetch(`${API_URL}/upload-image/${signalId}`, {
+        const response = await fetch(`${API_URL}/upload-image/${signalId}?wait=true`, {
             method: 'POST',
             body: formData
         });
@@ -185,13 +156,7 @@ async function handleImageUpload(event, signalId) {
 
         console.log(data);
         
-        updateSignalUI(signalId, {
-            vehicleCount: data.vehicle_count,
-            ambulanceDetected: data.ambulance_count,
-            // image: URL.createObjectURL(file)
-            image: data.image_url
-        });
-        
+        // The display is refreshed by the pushed update, the counts are needed right away for the timings
         controller.updateSignal(signalId, {
             vehicleCount: data.vehicle_count,
             ambulanceDetected: data.ambulance_count
@@ -209,6 +174,44 @@ async function handleImageUpload(event, signalId) {
     }
 }
 
+// Upload one image per signal in a single request, files are matched to signals in order
+async function handleBatchUpload(event) {
+    const files = Array.from(event.target.files).slice(0, SIGNALS.length);
+    if (files.length === 0) return;
+
+    const formData = new FormData();
+    formData.append('username', localStorage.getItem('username'));
+    files.forEach((file, index) => {
+        formData.append('signal_ids', SIGNALS[index].id);
+        formData.append('files', file);
+    });
+
+    try {
+        const response = await fetch(`${API_URL}/upload-images?wait=true`, {
+            method: 'POST',
+            body: formData
+        });
+
+        const data = await response.json();
+
+        data.signals.forEach(result => {
+            controller.updateSignal(result.signal_id, {
+                vehicleCount: result.vehicle_count,
+                ambulanceDetected: result.ambulance_count
+            });
+
+            if (result.ambulance_count > 0) {
+                showEmergencyAlert(result.signal_id);
+            }
+        });
+
+        await updateTimings();
+    } catch (error) {
+        console.error('Error uploading images:', error);
+        showError('Failed to upload images');
+    }
+}
+
 async function updateTimings() {
     const timings = Array.from(controller.signals.entries()).map(([id, data]) => ({
         signal_id: id,
@@ -231,9 +234,6 @@ async function updateTimings() {
         
         const data = await response.json();
         controller.emergencyMode = data.ambulance_priority;
-        
-        // Refresh display
-        await fetchInitialData();
     } catch (error) {
         console.error('Error updating timings:', error);
         showError('Failed to update signal timings');
@@ -294,59 +294,6 @@ function showEmergencyAlert(signalId) {
     setTimeout(() => alertDiv.remove(), 5000);
 }
 
-// Simulation Logic
-function runSignalCycle() {
-    const signalIds = Array.from(controller.signals.keys());
-    let currentSignalIndex = 0;
-    let currentTimer = null;
-
-    function updateCycle() {
-        const currentId = signalIds[currentSignalIndex];
-        const currentSignal = controller.getSignal(currentId);
-
-        // If ambulance detected, give priority
-        if (currentSignal.ambulanceDetected) {
-            controller.emergencyMode = true;
-            currentSignal.timing = 120; // Give 120 seconds to the signal with an emergency vehicle
-        } else {
-            controller.emergencyMode = false;
-        }
-
-        // Reset all signals to red
-        signalIds.forEach(id => {
-            controller.updateSignal(id, { status: 'Red' });
-        });
-
-        // Set current signal to green if timing is greater than 0
-        if (currentSignal.timing > 0) {
-            controller.updateSignal(currentId, { status: 'Green' });
-            updateSignalDisplays();
-
-            const cycleTime = controller.emergencyMode ? 120000 : currentSignal.timing * 1000;
-
-            // Schedule yellow light
-            currentTimer = setTimeout(() => {
-                controller.updateSignal(currentId, { status: 'Yellow' });
-                updateSignalDisplays();
-
-                // Schedule next signal
-                currentTimer = setTimeout(() => {
-                    currentSignalIndex = (currentSignalIndex + 1) % signalIds.length;
-                    updateCycle();
-                }, 1000); // Yellow light duration
-            }, cycleTime - 1000); // Subtract yellow light duration from cycle time
-        } else {
-            // If timing is 0, move to the next signal immediately
-            currentSignalIndex = (currentSignalIndex + 1) % signalIds.length;
-            updateCycle();
-        }
-    }
-
-    
-    updateCycle();
-}
-
-
 // Add to your CSS (styles.css)
 `.emergency-alert {
     position: fixed;
@@ -0,0 +1,346 @@
+"""
+Offline benchmark of the detection pipeline on synthetic traffic images and videos, or on fixture images.
+
+Times every stage (decode, preprocess, inference and NMS per model, result handling, annotation, CSV, update_timings),
+the end-to-end /upload-image latency and the per-frame video latency, and writes p50/p95/p99 per stage as JSON so two
+commits can be compared.
+
+Usage:
+    $ cd TrafficSystem
+    $ python benchmark.py --output bench.json
+    $ python benchmark.py --output new.json --compare bench.json
+    $ python benchmark.py --images ../samples --skip-video
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+# The benchmark drives the real app, so its signal database, uploads and annotated images go to a scratch directory
+# instead of the deployment's. Set before config is imported, and inherited by the inference workers.
+SCRATCH_DIR = Path(tempfile.mkdtemp(prefix="traffic-benchmark-"))
+os.environ.update(
+    SIGNAL_DB=str(SCRATCH_DIR / "signals.db"),
+    UPLOADS_DIR=str(SCRATCH_DIR / "uploads"),
+    RUNS_DIR=str(SCRATCH_DIR / "runs"),
+)
+
+import cv2
+import numpy as np
+import torch
+
+from config import CONF_THRES, IMG_SIZE, MODEL_BACKEND
+from yolo_module import configure_weights, count_video, decode_image, load_detectors
+
+from utils.dataloaders import IMG_FORMATS
+from utils.general import Profile, non_max_suppression
+
+PERCENTILES = (50, 95, 99)
+VEHICLE_COLORS = [(40, 40, 200), (200, 200, 200), (30, 30, 30), (180, 120, 40), (60, 160, 60), (0, 200, 255)]
+
+
+def synthetic_frame(width, height, vehicles, rng, offset=0):
+    """
+    A road scene with lanes and `vehicles` car-shaped boxes, smaller towards the top of the frame for perspective.
+    The same rng state gives the same scene, offset moves every vehicle down the frame by that many pixels.
+    """
+    im = np.full((height, width, 3), (70, 110, 60), dtype=np.uint8)  # verge
+    road_left, road_right = width // 6, width - width // 6
+    im[:, road_left:road_right] = (90, 90, 90)
+    lanes = 4
+    lane_width = (road_right - road_left) // lanes
+    for lane in range(1, lanes):
+        x = road_left + lane * lane_width
+        for y in range(-(offset % 60), height, 60):
+            cv2.line(im, (x, y), (x, y + 30), (230, 230, 230), max(1, width // 400))
+
+    for _ in range(vehicles):
+        lane = rng.integers(lanes)
+        y = (rng.integers(height) + offset) % height
+        scale = 0.4 + 0.6 * y / height
+        w, h = int(lane_width * 0.6 * scale), int(lane_width * 1.1 * scale)
+        x = road_left + lane * lane_width + (lane_width - w) // 2
+        color = VEHICLE_COLORS[rng.integers(len(VEHICLE_COLORS))]
+        cv2.rectangle(im, (x, y), (x + w, y + h), color, -1)
+        cv2.rectangle(im, (x + w // 8, y + h // 6), (x + w - w // 8, y + h // 3), (20, 20, 20), -1)  # windscreen
+        for wx in (x - w // 10, x + w - w // 10):
+            for wy in (y + h // 6, y + h - h // 3):
+                cv2.rectangle(im, (wx, wy), (wx + w // 5, wy + h // 6), (10, 10, 10), -1)  # wheels
+    return im
+
+
+def synthetic_video(path, width, height, vehicles, frames, fps=10, seed=0):
+    """
+    Write a video of vehicles moving down the lanes
+    """
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    for i in range(frames):
+        writer.write(synthetic_frame(width, height, vehicles, np.random.default_rng(seed), offset=i * height // 50))
+    writer.release()
+    return path
+
+
+def load_cases(opt):
+    """
+    Benchmark cases as (name, BGR image) pairs, synthetic unless a fixture directory is given
+    """
+    if opt.images:
+        files = sorted(p for p in Path(opt.images).iterdir() if p.suffix[1:].lower() in IMG_FORMATS)
+        return [(p.name, cv2.imread(str(p))) for p in files]
+    cases = []
+    for width, height in opt.resolutions:
+        for vehicles in opt.densities:
+            im = synthetic_frame(width, height, vehicles, np.random.default_rng(vehicles))
+            cases.append((f"{width}x{height}-{vehicles}v", im))
+    return cases
+
+
+def summarize(times):
+    """
+    Percentiles in milliseconds of a list of durations in seconds
+    """
+    ms = np.asarray(times) * 1000
+    summary = {f"p{q}": float(v) for q, v in zip(PERCENTILES, np.percentile(ms, PERCENTILES))}
+    summary.update(mean=float(ms.mean()), n=len(ms))
+    return summary
+
+
+def stage_times(detectors, im0, contents, runs, warmup, save_dir):
+    """
+    Time each stage of one upload run through the resident models the way detect_shared runs them
+    """
+    times = {}
+
+    def timed(stage, fn, device=None):
+        with Profile(device=device) as p:
+            result = fn()
+        if record:
+            times.setdefault(stage, []).append(p.dt)
+        return result
+
+    for i in range(warmup + runs):
+        record = i >= warmup
+        timed("decode", lambda: decode_image(contents))
+        im = timed("preprocess", lambda: detectors[0].preprocess([im0]), detectors[0].device)
+        for name, detector in zip(("vehicle", "ambulance"), detectors):
+            with torch.inference_mode():
+                raw = timed(f"inference/{name}", lambda: detector.model(im), detector.device)
+            pred = timed(f"nms/{name}", lambda: non_max_suppression(raw, CONF_THRES, 0.45, max_det=1000))
+            (result,) = timed(f"results/{name}", lambda: detector.postprocess([d.clone() for d in pred], im, [im0]))
+            timed(
+                f"annotate/{name}",
+                lambda: detector.postprocess(pred, im, [im0], ["frame.jpg"], Path(save_dir) / name),
+            )
+
+            def write_csv():
+                with open(Path(save_dir) / f"{name}.csv", "w", newline="") as f:
+                    writer = csv.writer(f)
+                    for conf, cls in zip(result.confidences, result.classes):
+                        writer.writerow(("frame.jpg", result.names[int(cls)], f"{conf:.2f}", 0))
+
+            timed(f"csv/{name}", write_csv)
+    return times
+
+
+def update_timings_times(server, runs, warmup):
+    """
+    Time the /update-timings handler on the four signals of an intersection, with and without an ambulance
+    """
+    update = server.SignalUpdate(
+        timings=[server.SignalTiming(signal_id=i, timing=0, vehicle_count=5 * i) for i in server.signals.all()],
+        total_time=120,
+    )
+    loop = asyncio.new_event_loop()
+    times = {}
+    try:
+        for stage, ambulances in (("update_timings", 0), ("update_timings/ambulance", 1)):
+            signal_ids = list(server.signals.all())
+            server.signals.update_many({i: {"ambulance_count": 0} for i in signal_ids})
+            server.signals.update(signal_ids[0], {"ambulance_count": ambulances})
+            for i in range(warmup + runs):
+                start = time.perf_counter()
+                loop.run_until_complete(server.update_timings(update))
+                if i >= warmup:
+                    times.setdefault(stage, []).append(time.perf_counter() - start)
+    finally:
+        loop.close()
+        server.signals.update_many({i: {"ambulance_count": 0} for i in server.signals.all()})
+    return times
+
+
+def upload_times(client, im0, runs, warmup):
+    """
+    End-to-end /upload-image latency. Every run changes one pixel so it misses the result cache, the last image is
+    then uploaded again to time cache hits.
+    """
+    times = {}
+    im0 = im0.copy()
+
+    def upload(stage, contents, record):
+        start = time.perf_counter()
+        response = client.post(
+            "/upload-image/1?wait=true", data={"username": "benchmark"}, files={"file": ("frame.jpg", contents)}
+        )
+        response.raise_for_status()
+        if record:
+            times.setdefault(stage, []).append(time.perf_counter() - start)
+
+    for i in range(warmup + runs):
+        im0[0, 0] = (i % 256, i // 256 % 256, 7)
+        contents = cv2.imencode(".jpg", im0, [cv2.IMWRITE_JPEG_QUALITY, 100])[1].tobytes()
+        upload("upload_image", contents, i >= warmup)
+    for _ in range(runs):
+        upload("upload_image/cached", contents, True)
+    return times
+
+
+def video_times(video_path):
+    """
+    Time count_video over a video, per frame from the gaps between frame callbacks
+    """
+    stamps = []
+    detector, _ = load_detectors()
+    original = detector.run
+
+    def run(*args, on_frame=None, **kwargs):
+        def timed_frame(frame, det):
+            stamps.append(time.perf_counter())
+            on_frame(frame, det)
+
+        return original(*args, on_frame=timed_frame, **kwargs)
+
+    detector.run = run
+    try:
+        start = time.perf_counter()
+        _, stats, _ = count_video(str(video_path))
+        total = time.perf_counter() - start
+    finally:
+        del detector.run
+    return {"video/frame": list(np.diff([start] + stamps)), "video/total": [total]}, stats["motion_gate"]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(results, baseline_path):
+    """
+    Print the change in p50 and p95 of every stage against an earlier benchmark file
+    """
+    baseline = json.loads(Path(baseline_path).read_text())
+    print(f"\nCompared with {baseline_path} ({baseline['meta'].get('commit')}):")
+    print(f"{'case':<24}{'stage':<28}{'p50 ms':>12}{'change':>10}{'p95 ms':>12}{'change':>10}")
+    for case, stages in results.items():
+        for stage, summary in stages.items():
+            old = baseline["results"].get(case, {}).get(stage)
+            if old is None:
+                continue
+            row = f"{case:<24}{stage:<28}"
+            for q in ("p50", "p95"):
+                change = (summary[q] - old[q]) / old[q] * 100 if old[q] else 0.0
+                row += f"{summary[q]:>12.2f}{change:>+9.1f}%"
+            print(row)
+
+
+def parse_opt():
+    """Parses command-line arguments for the pipeline benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=str, default="", help="directory of fixture images instead of synthetic ones")
+    parser.add_argument("--resolutions", type=str, default="640x480,1280x720,1920x1080,3840x2160")
+    parser.add_argument("--densities", type=str, default="0,8,32", help="vehicles drawn per synthetic image")
+    parser.add_argument("--runs", type=int, default=20, help="timed runs per case")
+    parser.add_argument("--warmup", type=int, default=3, help="untimed runs per case")
+    parser.add_argument("--video-frames", type=int, default=60, help="frames per synthetic video")
+    parser.add_argument("--skip-upload", action="store_true", help="skip the end-to-end /upload-image benchmark")
+    parser.add_argument("--skip-video", action="store_true", help="skip the video benchmark")
+    parser.add_argument("--output", type=str, default="benchmark.json", help="JSON results file")
+    parser.add_argument("--compare", type=str, default="", help="earlier JSON results file to compare against")
+    opt = parser.parse_args()
+    opt.resolutions = [tuple(int(v) for v in r.split("x")) for r in opt.resolutions.split(",")]
+    opt.densities = [int(v) for v in opt.densities.split(",")]
+    return opt
+
+
+def main(opt):
+    """Runs every benchmark case and writes the percentile summary to opt.output."""
+    try:
+        run(opt)
+    finally:
+        shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+
+
+def run(opt):
+    """Benchmarks every case, with the app's state kept in SCRATCH_DIR."""
+    import main as server  # the FastAPI app, for update_timings and the end-to-end uploads
+
+    configure_weights(*server.prepare_models())
+    detectors = load_detectors()
+    cases = load_cases(opt)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, im0 in cases:
+            contents = cv2.imencode(".jpg", im0)[1].tobytes()
+            times = stage_times(detectors, im0, contents, opt.runs, opt.warmup, tmp)
+            results[name] = {stage: summarize(t) for stage, t in times.items()}
+            print(f"{name}: " + ", ".join(f"{s} {r['p50']:.1f}ms" for s, r in results[name].items()))
+
+        results["intersection"] = {
+            stage: summarize(t) for stage, t in update_timings_times(server, opt.runs, opt.warmup).items()
+        }
+
+        if not opt.skip_upload:
+            from fastapi.testclient import TestClient
+
+            with TestClient(server.app) as client:  # runs the startup hooks, so uploads go through the worker pool
+                while client.get("/ready").json().get("status") == "loading":
+                    time.sleep(0.5)
+                for name, im0 in cases:
+                    times = upload_times(client, im0, opt.runs, opt.warmup)
+                    results[name].update({stage: summarize(t) for stage, t in times.items()})
+                    print(f"{name}: upload_image {results[name]['upload_image']['p50']:.1f}ms")
+
+        motion_gate = {}
+        if not opt.skip_video and not opt.images:
+            for width, height in opt.resolutions:
+                vehicles = max(opt.densities)
+                name = f"video-{width}x{height}-{vehicles}v"
+                video = synthetic_video(Path(tmp) / f"{name}.mp4", width, height, vehicles, opt.video_frames)
+                times, motion_gate[name] = video_times(video)
+                results[name] = {stage: summarize(t) for stage, t in times.items()}
+                print(f"{name}: frame {results[name]['video/frame']['p50']:.1f}ms")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "backend": MODEL_BACKEND,
+            "imgsz": IMG_SIZE,
+            "runs": opt.runs,
+            "motion_gate": motion_gate,
+        },
+        "results": results,
+    }
+    Path(opt.output).write_text(json.dumps(report, indent=2))
+    print(f"Results saved to {opt.output}")
+    if opt.compare:
+        compare(results, opt.compare)
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
@@ -0,0 +1,102 @@
+import os
+from pathlib import Path
+
+# Paths are resolved from this file so the server works regardless of the launch directory
+BASE_DIR = Path(__file__).resolve().parent
+PROJECT_DIR = BASE_DIR.parent
+
+YOLOV5_DIR = Path(os.environ.get("YOLOV5_DIR", PROJECT_DIR / "yolov5"))
+RUNS_DIR = Path(os.environ.get("RUNS_DIR", YOLOV5_DIR / "runs" / "detect"))
+UPLOADS_DIR = Path(os.environ.get("UPLOADS_DIR", "uploads"))
+# Keep a copy of every uploaded original, written after the response in the background
+PERSIST_UPLOADS = os.environ.get("PERSIST_UPLOADS", "1") == "1"
+
+# Detection models
+VEHICLE_WEIGHTS = os.environ.get("VEHICLE_WEIGHTS", str(PROJECT_DIR / "best.pt"))
+AMBULANCE_WEIGHTS = os.environ.get("AMBULANCE_WEIGHTS", str(PROJECT_DIR / "er_best.pt"))
+IMG_SIZE = int(os.environ.get("IMG_SIZE", 640))
+# Tiled inference for high-resolution cameras, off with TILE_SIZE=0. Frames larger than TILE_SIZE pixels are also run
+# as overlapping tiles, only over TILE_REGION (x0,y0,x1,y1 fractions, e.g. "0,0,1,0.5" for the far field) if set
+TILE_SIZE = int(os.environ.get("TILE_SIZE", 0))
+TILE_OVERLAP = float(os.environ.get("TILE_OVERLAP", 0.2))
+TILE_REGION = tuple(float(v) for v in os.environ["TILE_REGION"].split(",")) if os.environ.get("TILE_REGION") else None
+TILE_BATCH = int(os.environ.get("TILE_BATCH", 16))
+CONF_THRES = float(os.environ.get("CONF_THRES", 0.4))
+DEVICE = os.environ.get("DEVICE", "")
+
+# Model backend: pt, onnx, onnx-int8, openvino, or auto to benchmark the candidates at startup and pick the fastest
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "pt")
+MODEL_BACKEND_CANDIDATES = os.environ.get("MODEL_BACKEND_CANDIDATES", "pt,onnx,onnx-int8,openvino").split(",")
+MODEL_CALIBRATION_DIR = os.environ.get("MODEL_CALIBRATION_DIR", "")
+MODEL_MAX_COUNT_DELTA = float(os.environ.get("MODEL_MAX_COUNT_DELTA", 0.5))
+MODEL_BENCHMARK_RUNS = int(os.environ.get("MODEL_BENCHMARK_RUNS", 10))
+
+# Inference worker pool
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 2))
+# Server processes forked by serve.py, each with its own INFERENCE_WORKERS
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", max(1, (os.cpu_count() or 1) // INFERENCE_WORKERS)))
+# Worker calls allowed to wait beyond the INFERENCE_WORKERS running ones, a coalesced batch of uploads is one call
+INFERENCE_QUEUE_SIZE = int(os.environ.get("INFERENCE_QUEUE_SIZE", 16))
+INFERENCE_TIMEOUT = float(os.environ.get("INFERENCE_TIMEOUT", 60))
+INFERENCE_START_METHOD = os.environ.get("INFERENCE_START_METHOD", "spawn")
+# Concurrent single-image uploads are coalesced for up to INFERENCE_BATCH_WAIT seconds or INFERENCE_BATCH_SIZE images
+# and run as one batch, INFERENCE_BATCH_SIZE=1 turns this off
+INFERENCE_BATCH_SIZE = int(os.environ.get("INFERENCE_BATCH_SIZE", 8))
+INFERENCE_BATCH_WAIT = float(os.environ.get("INFERENCE_BATCH_WAIT", 0.005))
+JOB_TTL = float(os.environ.get("JOB_TTL", 600))
+# Running statistics of video jobs, written by the inference workers and read by /jobs/{job_id}
+JOB_PROGRESS_DIR = Path(os.environ.get("JOB_PROGRESS_DIR", "progress"))
+
+# Retention limits for detection runs and per-user uploads, a limit of 0 disables it
+RETENTION_INTERVAL = float(os.environ.get("RETENTION_INTERVAL", 300))
+RUNS_MAX_AGE = float(os.environ.get("RUNS_MAX_AGE", 7 * 24 * 3600))
+RUNS_MAX_COUNT = int(os.environ.get("RUNS_MAX_COUNT", 1000))
+RUNS_MAX_BYTES = int(os.environ.get("RUNS_MAX_BYTES", 2 * 1024**3))
+UPLOADS_MAX_AGE = float(os.environ.get("UPLOADS_MAX_AGE", 7 * 24 * 3600))
+UPLOADS_MAX_COUNT = int(os.environ.get("UPLOADS_MAX_COUNT", 500))
+UPLOADS_MAX_BYTES = int(os.environ.get("UPLOADS_MAX_BYTES", 512 * 1024**2))
+
+# Detection result cache, entries are dropped when the retention collector removes their runs
+RESULT_CACHE_ENTRIES = int(os.environ.get("RESULT_CACHE_ENTRIES", 1024))
+RESULT_CACHE_BYTES = int(os.environ.get("RESULT_CACHE_BYTES", 256 * 1024**2))
+
+# Live stream ingestion
+STREAM_SAMPLE_FPS = float(os.environ.get("STREAM_SAMPLE_FPS", 1.0))
+STREAM_WINDOW = int(os.environ.get("STREAM_WINDOW", 10))
+STREAM_RECONNECT_DELAY = float(os.environ.get("STREAM_RECONNECT_DELAY", 5.0))
+
+# Video uploads
+VIDEO_MAX_BYTES = int(os.environ.get("VIDEO_MAX_BYTES", 1024**3))
+VIDEO_TIMEOUT = float(os.environ.get("VIDEO_TIMEOUT", 1800))
+
+# Scene-change gating for videos and streams, a threshold of 0 disables it
+MOTION_GATE_THRESHOLD = float(os.environ.get("MOTION_GATE_THRESHOLD", 2.0))
+MOTION_GATE_MAX_SKIP = int(os.environ.get("MOTION_GATE_MAX_SKIP", 30))
+
+# Admin endpoints such as the request profiler are disabled unless a token is set, sent as the X-Admin-Token header
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+PROFILES_DIR = Path(os.environ.get("PROFILES_DIR", "profiles"))
+
+# Intersection and signal registry, persisted to SQLite with signal state changes written in batches
+SIGNAL_DB = Path(os.environ.get("SIGNAL_DB", "signals.db"))
+SIGNAL_FLUSH_INTERVAL = float(os.environ.get("SIGNAL_FLUSH_INTERVAL", 1.0))
+SIGNALS_PAGE_SIZE = int(os.environ.get("SIGNALS_PAGE_SIZE", 100))
+SIGNALS_MAX_PAGE_SIZE = int(os.environ.get("SIGNALS_MAX_PAGE_SIZE", 1000))
+
+# Server-sent signal updates, changes made by other pre-forked workers are picked up every SIGNAL_EVENTS_INTERVAL
+SIGNAL_EVENTS_INTERVAL = float(os.environ.get("SIGNAL_EVENTS_INTERVAL", 0.25))
+SIGNAL_EVENTS_QUEUE = int(os.environ.get("SIGNAL_EVENTS_QUEUE", 256))
+SIGNAL_EVENTS_HEARTBEAT = float(os.environ.get("SIGNAL_EVENTS_HEARTBEAT", 15.0))
+
+# Webster signal timing, vehicle counts are taken as arrivals per TIMING_COUNT_INTERVAL seconds
+TIMING_SATURATION_FLOW = float(os.environ.get("TIMING_SATURATION_FLOW", 0.5))  # vehicles per second of green
+TIMING_LOST_TIME = float(os.environ.get("TIMING_LOST_TIME", 4.0))  # seconds per phase
+TIMING_MIN_GREEN = float(os.environ.get("TIMING_MIN_GREEN", 10.0))
+TIMING_MAX_GREEN = float(os.environ.get("TIMING_MAX_GREEN", 90.0))
+TIMING_MIN_CYCLE = float(os.environ.get("TIMING_MIN_CYCLE", 40.0))
+TIMING_MAX_CYCLE = float(os.environ.get("TIMING_MAX_CYCLE", 180.0))
+TIMING_PREEMPT_GREEN = float(os.environ.get("TIMING_PREEMPT_GREEN", 45.0))
+TIMING_COUNT_INTERVAL = float(os.environ.get("TIMING_COUNT_INTERVAL", 60.0))
+
+# Signal cycles run on the server, in one worker under the pre-fork server. Set SIGNAL_CYCLES=0 to turn them off.
+SIGNAL_CYCLES = os.environ.get("SIGNAL_CYCLES", "1") != "0"
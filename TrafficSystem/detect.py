@@ -32,8 +32,12 @@ import csv
 import os
 import platform
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
 from pathlib import Path
 
+import numpy as np
 import torch
 
 FILE = Path(__file__).resolve()
@@ -45,6 +49,7 @@ ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 from ultralytics.utils.plotting import Annotator, colors, save_one_box
 
 from models.common import DetectMultiBackend
+from utils.augmentations import letterbox
 from utils.dataloaders import IMG_FORMATS, VID_FORMATS, LoadImages, LoadScreenshots, LoadStreams
 from utils.general import (
     LOGGER,
@@ -65,6 +70,643 @@ from utils.general import (
 from utils.torch_utils import select_device, smart_inference_mode
 
 
+@dataclass
+class Detections:
+    """
+    Array-backed detection results returned by `Detector.run`, one row per detected box.
+
+    Attributes:
+        boxes (np.ndarray): Boxes as an (N, 4) float32 array of xyxy pixel coordinates in the original image.
+        confidences (np.ndarray): Confidence of each box as an (N,) float32 array.
+        classes (np.ndarray): Class index of each box as an (N,) int64 array.
+        frames (np.ndarray): Frame index each box was detected in as an (N,) int64 array, 0 for still images.
+        names (dict[int, str]): Class index to class name mapping of the model.
+        save_dir (Path | None): Directory the run saved its outputs to.
+        save_paths (list[str]): Annotated images or videos written during the run.
+
+    Examples:
+        ```python
+        detections = detector.run(source='data/images/example.jpg')
+        print(len(detections), detections.counts())
+        ```
+    """
+
+    boxes: np.ndarray
+    confidences: np.ndarray
+    classes: np.ndarray
+    frames: np.ndarray
+    names: dict
+    save_dir: Path = None
+    save_paths: list = field(default_factory=list)
+
+    def __len__(self):
+        """Returns the number of detected boxes."""
+        return len(self.classes)
+
+    def counts(self):
+        """Returns the number of boxes per class index as an array of length `len(names)`."""
+        return np.bincount(self.classes, minlength=len(self.names))
+
+    @classmethod
+    def from_array(cls, det, frames, names, save_dir=None, save_paths=None):
+        """Builds results from an (N, 6) xyxy-conf-cls array and the (N,) frame index of each row."""
+        return cls(
+            boxes=det[:, :4].astype(np.float32),
+            confidences=det[:, 4].astype(np.float32),
+            classes=det[:, 5].astype(np.int64),
+            frames=np.asarray(frames, dtype=np.int64),
+            names=names,
+            save_dir=save_dir,
+            save_paths=save_paths or [],
+        )
+
+
+class Detector:
+    """
+    Keeps a YOLOv5 model resident in memory so repeated inference calls skip weight loading and warmup.
+
+    Args:
+        weights (str | Path): Path to the model weights file or a Triton URL. Default is 'yolov5s.pt'.
+        data (str | Path): Path to the dataset YAML file. Default is 'data/coco128.yaml'.
+        imgsz (tuple[int, int]): Inference image size as a tuple (height, width). Default is (640, 640).
+        device (str): CUDA device identifier (e.g., '0' or '0,1,2,3') or 'cpu'. Default is an empty string, which uses the
+            best available device.
+        half (bool): If True, use FP16 half-precision inference. Default is False.
+        dnn (bool): If True, use OpenCV DNN backend for ONNX inference. Default is False.
+
+    Examples:
+        ```python
+        detector = Detector(weights='best.pt', imgsz=(640, 640))
+
+        # The model is loaded once and reused for every call
+        detector.run(source='data/images/example.jpg', conf_thres=0.4)
+        detector.run(source='data/images/other.jpg', conf_thres=0.4)
+        ```
+    """
+
+    def __init__(
+        self,
+        weights=ROOT / "yolov5s.pt",  # model path or triton URL
+        data=ROOT / "data/coco128.yaml",  # dataset.yaml path
+        imgsz=(640, 640),  # inference size (height, width)
+        device="",  # cuda device, i.e. 0 or 0,1,2,3 or cpu
+        half=False,  # use FP16 half-precision inference
+        dnn=False,  # use OpenCV DNN for ONNX inference
+    ):
+        """Loads the model weights onto the selected device and warms the model up once."""
+        self.weights = weights
+        self.device = select_device(device)
+        self.model = DetectMultiBackend(weights, device=self.device, dnn=dnn, data=data, fp16=half)
+        self.stride, self.names, self.pt = self.model.stride, self.model.names, self.model.pt
+        self.imgsz = check_img_size(imgsz, s=self.stride)  # check image size
+        self.model.warmup(imgsz=(1, 3, *self.imgsz))  # warmup
+
+    @smart_inference_mode()
+    def run(
+        self,
+        source=ROOT / "data/images",  # file/dir/URL/glob/screen/0(webcam)
+        conf_thres=0.25,  # confidence threshold
+        iou_thres=0.45,  # NMS IOU threshold
+        max_det=1000,  # maximum detections per image
+        view_img=False,  # show results
+        save_txt=False,  # save results to *.txt
+        save_format=0,  # save boxes coordinates in YOLO format or Pascal-VOC format (0 for YOLO and 1 for Pascal-VOC)
+        save_csv=False,  # save results in CSV format
+        save_conf=False,  # save confidences in --save-txt labels
+        save_crop=False,  # save cropped prediction boxes
+        nosave=False,  # do not save images/videos
+        classes=None,  # filter by class: --class 0, or --class 0 2 3
+        agnostic_nms=False,  # class-agnostic NMS
+        augment=False,  # augmented inference
+        visualize=False,  # visualize features
+        project=ROOT / "runs/detect",  # save results to project/name
+        name="exp",  # save results to project/name
+        exist_ok=False,  # existing project/name ok, do not increment
+        line_thickness=3,  # bounding box thickness (pixels)
+        hide_labels=False,  # hide labels
+        hide_conf=False,  # hide confidences
+        vid_stride=1,  # video frame-rate stride
+        on_frame=None,  # callback(frame, det) for every processed image
+        keep_results=True,  # collect detections for the returned Detections
+        gate=None,  # scene-change gate, skip inference on unchanged frames
+    ):
+        """
+        Runs detection on a source with the resident model. Arguments match the module-level `run` function.
+
+        `on_frame` is called with the frame index and the (n, 6) xyxy-conf-cls array of every processed image as soon as
+        it is available, including images without detections. Set `keep_results` to False to consume detections only
+        through `on_frame`, which keeps memory flat on long videos and streams.
+
+        `gate` is any object with a `changed(im0, key)` method, e.g. `motion_gate.MotionGate`. When it reports that no
+        image in a batch changed since the last inferred frame, the forward pass and NMS are skipped and the previous
+        detections are reused.
+
+        Returns:
+            (Detections): Boxes, confidences, classes and frame indices of every detection in the source.
+        """
+        model, device, stride, names, pt, imgsz = self.model, self.device, self.stride, self.names, self.pt, self.imgsz
+
+        source = str(source)
+        save_img = not nosave and not source.endswith(".txt")  # save inference images
+        is_file = Path(source).suffix[1:] in (IMG_FORMATS + VID_FORMATS)
+        is_url = source.lower().startswith(("rtsp://", "rtmp://", "http://", "https://"))
+        webcam = source.isnumeric() or source.endswith(".streams") or (is_url and not is_file)
+        screenshot = source.lower().startswith("screen")
+        if is_url and is_file:
+            source = check_file(source)  # download
+
+        # Directories
+        save_dir = increment_path(Path(project) / name, exist_ok=exist_ok)  # increment run
+        (save_dir / "labels" if save_txt else save_dir).mkdir(parents=True, exist_ok=True)  # make dir
+
+        # Dataloader
+        bs = 1  # batch_size
+        if webcam:
+            view_img = check_imshow(warn=True)
+            dataset = LoadStreams(source, img_size=imgsz, stride=stride, auto=pt, vid_stride=vid_stride)
+            bs = len(dataset)
+        elif screenshot:
+            dataset = LoadScreenshots(source, img_size=imgsz, stride=stride, auto=pt)
+        else:
+            dataset = LoadImages(source, img_size=imgsz, stride=stride, auto=pt, vid_stride=vid_stride)
+        vid_path, vid_writer = [None] * bs, [None] * bs
+
+        # Run inference
+        if not (pt or model.triton) and bs > 1:
+            model.warmup(imgsz=(bs, 3, *imgsz))  # re-warm for batched stream input
+        seen, windows, dt = 0, [], (Profile(device=device), Profile(device=device), Profile(device=device))
+        results, result_frames, save_paths = [], [], []
+        last_pred, reuse = None, False
+
+        # Define the path for the CSV file, opened once on the first prediction and kept open for the run
+        csv_path = save_dir / "predictions.csv"
+        csv_file = None
+
+        def write_to_csv(image_name, prediction, confidence, frame):
+            """Appends prediction data for an image to the CSV file, opening the file on first use."""
+            nonlocal csv_file
+            if csv_file is None:
+                csv_file = open(csv_path, mode="a", newline="")
+            csv.writer(csv_file).writerow((image_name, prediction, confidence, frame))
+
+        for path, im, im0s, vid_cap, s in dataset:
+            with dt[0]:
+                im = torch.from_numpy(im).to(model.device)
+                im = im.half() if model.fp16 else im.float()  # uint8 to fp16/32
+                im /= 255  # 0 - 255 to 0.0 - 1.0
+                if len(im.shape) == 3:
+                    im = im[None]  # expand for batch dim
+                if model.xml and im.shape[0] > 1:
+                    ims = torch.chunk(im, im.shape[0], 0)
+
+            # Reuse the previous detections when the gate sees no scene change in any image of the batch
+            if gate is not None:
+                frames0 = zip(path, im0s) if webcam else [(path, im0s)]
+                changed = [gate.changed(im0, key=f"{p}:{i}") for i, (p, im0) in enumerate(frames0)]
+                reuse = last_pred is not None and not any(changed)
+
+            if reuse:
+                pred = [d.clone() for d in last_pred]
+            else:
+                # Inference
+                with dt[1]:
+                    visualize = increment_path(save_dir / Path(path).stem, mkdir=True) if visualize else False
+                    if model.xml and im.shape[0] > 1:
+                        pred = None
+                        for image in ims:
+                            if pred is None:
+                                pred = model(image, augment=augment, visualize=visualize).unsqueeze(0)
+                            else:
+                                pred = torch.cat((pred, model(image, augment=augment, visualize=visualize).unsqueeze(0)), dim=0)
+                        pred = [pred, None]
+                    else:
+                        pred = model(im, augment=augment, visualize=visualize)
+                # NMS
+                with dt[2]:
+                    pred = non_max_suppression(pred, conf_thres, iou_thres, classes, agnostic_nms, max_det=max_det)
+
+            # Second-stage classifier (optional)
+            # pred = utils.general.apply_classifier(pred, classifier_model, im, im0s)
+
+            # Process predictions
+            for i, det in enumerate(pred):  # per image
+                seen += 1
+                if webcam:  # batch_size >= 1
+                    p, im0, frame = path[i], im0s[i].copy(), dataset.count
+                    s += f"{i}: "
+                else:
+                    p, im0, frame = path, im0s.copy(), getattr(dataset, "frame", 0)
+
+                p = Path(p)  # to Path
+                save_path = str(save_dir / p.name)  # im.jpg
+                txt_path = str(save_dir / "labels" / p.stem) + ("" if dataset.mode == "image" else f"_{frame}")  # im.txt
+                s += "{:g}x{:g} ".format(*im.shape[2:])  # print string
+                gn = torch.tensor(im0.shape)[[1, 0, 1, 0]]  # normalization gain whwh
+                imc = im0.copy() if save_crop else im0  # for save_crop
+                annotator = Annotator(im0, line_width=line_thickness, example=str(names))
+                if len(det):
+                    # Rescale boxes from img_size to im0 size, reused detections are already rescaled
+                    if not reuse:
+                        det[:, :4] = scale_boxes(im.shape[2:], det[:, :4], im0.shape).round()
+                    if keep_results:
+                        results.append(det.cpu().numpy())
+                        result_frames.append(np.full(len(det), frame, dtype=np.int64))
+
+                    # Print results
+                    for c in det[:, 5].unique():
+                        n = (det[:, 5] == c).sum()  # detections per class
+                        s += f"{n} {names[int(c)]}{'s' * (n > 1)}, "  # add to string
+
+                    # Write results
+                    for *xyxy, conf, cls in reversed(det):
+                        c = int(cls)  # integer class
+                        label = names[c] if hide_conf else f"{names[c]}"
+                        confidence = float(conf)
+                        confidence_str = f"{confidence:.2f}"
+
+                        if save_csv:
+                            write_to_csv(p.name, label, confidence_str, frame)
+
+                        if save_txt:  # Write to file
+                            if save_format == 0:
+                                coords = (
+                                    (xyxy2xywh(torch.tensor(xyxy).view(1, 4)) / gn).view(-1).tolist()
+                                )  # normalized xywh
+                            else:
+                                coords = (torch.tensor(xyxy).view(1, 4) / gn).view(-1).tolist()  # xyxy
+                            line = (cls, *coords, conf) if save_conf else (cls, *coords)  # label format
+                            with open(f"{txt_path}.txt", "a") as f:
+                                f.write(("%g " * len(line)).rstrip() % line + "\n")
+
+                        if save_img or save_crop or view_img:  # Add bbox to image
+                            c = int(cls)  # integer class
+                            label = None if hide_labels else (names[c] if hide_conf else f"{names[c]} {conf:.2f}")
+                            annotator.box_label(xyxy, label, color=colors(c, True))
+                        if save_crop:
+                            save_one_box(xyxy, imc, file=save_dir / "crops" / names[c] / f"{p.stem}.jpg", BGR=True)
+
+                if on_frame is not None:
+                    on_frame(frame, det.cpu().numpy())
+
+                # Stream results
+                im0 = annotator.result()
+                if view_img:
+                    if platform.system() == "Linux" and p not in windows:
+                        windows.append(p)
+                        cv2.namedWindow(str(p), cv2.WINDOW_NORMAL | cv2.WINDOW_KEEPRATIO)  # allow window resize (Linux)
+                        cv2.resizeWindow(str(p), im0.shape[1], im0.shape[0])
+                    cv2.imshow(str(p), im0)
+                    cv2.waitKey(1)  # 1 millisecond
+
+                # Save results (image with detections)
+                if save_img:
+                    if dataset.mode == "image":
+                        cv2.imwrite(save_path, im0)
+                        save_paths.append(save_path)
+                    else:  # 'video' or 'stream'
+                        if vid_path[i] != save_path:  # new video
+                            vid_path[i] = save_path
+                            if isinstance(vid_writer[i], cv2.VideoWriter):
+                                vid_writer[i].release()  # release previous video writer
+                            if vid_cap:  # video
+                                fps = vid_cap.get(cv2.CAP_PROP_FPS)
+                                w = int(vid_cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+                                h = int(vid_cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+                            else:  # stream
+                                fps, w, h = 30, im0.shape[1], im0.shape[0]
+                            save_path = str(Path(save_path).with_suffix(".mp4"))  # force *.mp4 suffix on results videos
+                            vid_writer[i] = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (w, h))
+                            save_paths.append(save_path)
+                        vid_writer[i].write(im0)
+
+            if gate is not None and not reuse:
+                last_pred = [d.clone() for d in pred]
+
+            # Print time (inference-only)
+            LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{'reused' if reuse else f'{dt[1].dt * 1E3:.1f}ms'}")
+
+        # Print results
+        t = tuple(x.t / seen * 1e3 for x in dt)  # speeds per image
+        LOGGER.info(f"Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS per image at shape {(1, 3, *imgsz)}" % t)
+        if save_txt or save_img:
+            s = f"\n{len(list(save_dir.glob('labels/*.txt')))} labels saved to {save_dir / 'labels'}" if save_txt else ""
+            LOGGER.info(f"Results saved to {colorstr('bold', save_dir)}{s}")
+        if csv_file is not None:
+            csv_file.close()
+        for writer in vid_writer:
+            if isinstance(writer, cv2.VideoWriter):
+                writer.release()  # finalise result videos, the process outlives the run
+
+        stacked = np.concatenate(results) if results else np.zeros((0, 6), dtype=np.float32)
+        frames = np.concatenate(result_frames) if result_frames else np.zeros(0, dtype=np.int64)
+        return Detections.from_array(stacked, frames, names, save_dir=save_dir, save_paths=save_paths)
+
+    def preprocess(self, im0s, auto=None):
+        """
+        Letterboxes BGR images to the model input size and stacks them into one normalised batch tensor.
+
+        Args:
+            im0s (list[np.ndarray]): Original BGR images as HWC uint8 arrays.
+            auto (bool | None): Use minimum rectangle padding. Defaults to the PyTorch backend setting for a single
+                image and to False for batches, so every image in the batch shares one shape.
+
+        Returns:
+            (torch.Tensor): Batch of shape (B, 3, H, W) on the model device, scaled to 0.0 - 1.0.
+        """
+        if auto is None:
+            auto = self.pt and len(im0s) == 1
+        ims = [letterbox(im0, self.imgsz, stride=self.stride, auto=auto)[0] for im0 in im0s]
+        im = np.ascontiguousarray(np.stack(ims).transpose((0, 3, 1, 2))[:, ::-1])  # BHWC to BCHW, BGR to RGB
+        im = torch.from_numpy(im).to(self.device)
+        im = im.half() if self.model.fp16 else im.float()  # uint8 to fp16/32
+        im /= 255  # 0 - 255 to 0.0 - 1.0
+        return im
+
+    @smart_inference_mode()
+    def infer(self, im, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic_nms=False, max_det=1000, augment=False):
+        """
+        Runs the forward pass and NMS on a preprocessed batch from `preprocess`.
+
+        Returns:
+            (list[torch.Tensor]): One (n, 6) tensor of xyxy, confidence, class rows per image, in input-tensor pixels.
+        """
+        if self.model.xml and im.shape[0] > 1:
+            outputs = [self.model(image, augment=augment) for image in torch.chunk(im, im.shape[0], 0)]
+            pred = torch.cat([y[0] if isinstance(y, (list, tuple)) else y for y in outputs], 0)
+        else:
+            pred = self.model(im, augment=augment)
+        return non_max_suppression(pred, conf_thres, iou_thres, classes, agnostic_nms, max_det=max_det)
+
+    def postprocess(
+        self, pred, im, im0s, paths=None, save_dir=None, line_thickness=3, hide_labels=False, hide_conf=False
+    ):
+        """
+        Rescales `infer` output to the original images and optionally saves annotated copies to `save_dir`.
+
+        Returns:
+            (list[Detections]): One result per image.
+        """
+        results = []
+        for i, (det, im0) in enumerate(zip(pred, im0s)):
+            det[:, :4] = scale_boxes(im.shape[2:], det[:, :4], im0.shape).round()
+            det = det.cpu().numpy()
+            save_paths = []
+            if save_dir is not None:
+                save_path = str(Path(save_dir) / (Path(paths[i]).name if paths else f"image{i}.jpg"))
+                save_paths.append(self.annotate(im0, det, save_path, line_thickness, hide_labels, hide_conf))
+            results.append(Detections.from_array(det, np.zeros(len(det)), self.names, save_dir, save_paths))
+        return results
+
+    def annotate(self, im0, det, save_path, line_thickness=3, hide_labels=False, hide_conf=False):
+        """
+        Draws an (N, 6) xyxy-conf-cls array of original-image boxes on a copy of `im0` and writes it to `save_path`.
+
+        Returns:
+            (str): `save_path`.
+        """
+        annotator = Annotator(im0.copy(), line_width=line_thickness, example=str(self.names))
+        for *xyxy, conf, cls in reversed(det):
+            c = int(cls)  # integer class
+            label = None if hide_labels else (self.names[c] if hide_conf else f"{self.names[c]} {conf:.2f}")
+            annotator.box_label(xyxy, label, color=colors(c, True))
+        Path(save_path).parent.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(save_path, annotator.result())
+        return save_path
+
+
+def detect_shared(
+    detectors,
+    im0s,
+    paths=None,
+    save_dirs=None,
+    conf_thres=0.25,
+    iou_thres=0.45,
+    max_det=1000,
+    concurrent=True,
+    stage_timer=None,
+):
+    """
+    Runs several resident models on the same images, decoding and preprocessing them only once.
+
+    Models with matching stride, input size, backend and device share a single input tensor. The forward passes run
+    in parallel threads when `concurrent` is True, since PyTorch releases the GIL during inference.
+
+    Args:
+        detectors (list[Detector]): Resident models to run.
+        im0s (list[np.ndarray]): Original BGR images as HWC uint8 arrays.
+        paths (list[str] | None): Source path of each image, used to name annotated outputs.
+        save_dirs (list[str | Path | None] | None): Output directory per detector, None to skip annotation.
+        conf_thres (float): Confidence threshold for detections. Default is 0.25.
+        iou_thres (float): Intersection Over Union (IOU) threshold for non-max suppression. Default is 0.45.
+        max_det (int): Maximum number of detections per image. Default is 1000.
+        concurrent (bool): Run the models in parallel threads. Default is True.
+        stage_timer (Callable | None): Called as `stage_timer(stage, i)` with "preprocess", "inference" or
+            "postprocess" and the detector index (None for shared preprocessing), returning a context manager that
+            times the stage.
+
+    Returns:
+        (list[list[Detections]]): Results indexed by detector, then by image.
+
+    Examples:
+        ```python
+        im0 = cv2.imread('data/images/example.jpg')
+        (vehicles,), (ambulances,) = detect_shared([vehicle_detector, ambulance_detector], [im0])
+        ```
+    """
+    def input_spec(d):
+        return d.stride, d.imgsz, d.pt, d.device, d.model.fp16
+
+    stage_timer = stage_timer or (lambda stage, i: nullcontext())
+    first = detectors[0]
+    shared = all(input_spec(d) == input_spec(first) for d in detectors)
+    if shared:
+        with stage_timer("preprocess", None):
+            ims = [first.preprocess(im0s)] * len(detectors)
+    else:
+        ims = []
+        for i, d in enumerate(detectors):
+            with stage_timer("preprocess", i):
+                ims.append(d.preprocess(im0s))
+
+    def infer(i, detector, im):
+        with stage_timer("inference", i):
+            return detector.infer(im, conf_thres=conf_thres, iou_thres=iou_thres, max_det=max_det)
+
+    indices = range(len(detectors))
+    if concurrent and len(detectors) > 1:
+        with ThreadPoolExecutor(max_workers=len(detectors)) as pool:
+            preds = list(pool.map(infer, indices, detectors, ims))
+    else:
+        preds = [infer(i, d, im) for i, d, im in zip(indices, detectors, ims)]
+
+    save_dirs = save_dirs or [None] * len(detectors)
+    results = []
+    for i, (d, pred, im, sd) in enumerate(zip(detectors, preds, ims, save_dirs)):
+        with stage_timer("postprocess", i):
+            results.append(d.postprocess(pred, im, im0s, paths, sd))
+    return results
+
+
+def tile_windows(shape, tile_size, overlap=0.2, region=None):
+    """
+    Splits an image into overlapping square tiles.
+
+    Args:
+        shape (tuple[int, int]): Image height and width.
+        tile_size (int): Tile side in image pixels.
+        overlap (float): Fraction of a tile shared with its neighbours, so objects cut by one tile are whole in the
+            next. Default is 0.2.
+        region (tuple[float, float, float, float] | None): Part of the image to tile as x0, y0, x1, y1 fractions of
+            its width and height, e.g. (0, 0, 1, 0.5) for the far field of a camera facing down the road. Default is
+            the whole image.
+
+    Returns:
+        (list[tuple[int, int, int, int]]): Tile windows as x0, y0, x1, y1 pixels, empty if the image fits in one tile.
+    """
+    h, w = shape
+    if h <= tile_size and w <= tile_size:
+        return []
+    rx0, ry0, rx1, ry1 = region or (0.0, 0.0, 1.0, 1.0)
+    x_lo, y_lo, x_hi, y_hi = int(rx0 * w), int(ry0 * h), int(rx1 * w), int(ry1 * h)
+    step = max(1, int(tile_size * (1 - overlap)))
+
+    def starts(lo, hi):
+        if hi - lo <= tile_size:
+            return [lo]
+        return list(range(lo, hi - tile_size, step)) + [hi - tile_size]  # the last tile ends on the edge
+
+    return [
+        (x, y, min(x + tile_size, x_hi), min(y + tile_size, y_hi))
+        for y in starts(y_lo, y_hi)
+        for x in starts(x_lo, x_hi)
+    ]
+
+
+def merge_detections(det, iou_thres=0.45, ios_thres=0.8, max_det=1000):
+    """
+    Class-aware greedy NMS over boxes gathered from several tiles of one image.
+
+    Besides the usual IoU test, a box is suppressed when most of it lies inside a higher-confidence box of the same
+    class (intersection over the smaller box above `ios_thres`), which removes the partial boxes of vehicles cut
+    by a tile edge.
+
+    Args:
+        det (np.ndarray): (N, 6) array of xyxy, confidence, class rows in image pixels.
+
+    Returns:
+        (np.ndarray): The kept rows, highest confidence first.
+    """
+    det = det[det[:, 4].argsort()[::-1]]
+    boxes, classes = det[:, :4], det[:, 5]
+    areas = (boxes[:, 2] - boxes[:, 0]).clip(0) * (boxes[:, 3] - boxes[:, 1]).clip(0)
+    suppressed = np.zeros(len(det), dtype=bool)
+    keep = []
+    for i in range(len(det)):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        if len(keep) == max_det:
+            break
+        rest = np.flatnonzero(~suppressed[i + 1 :] & (classes[i + 1 :] == classes[i])) + i + 1
+        if not len(rest):
+            continue
+        wh = (np.minimum(boxes[rest, 2:], boxes[i, 2:]) - np.maximum(boxes[rest, :2], boxes[i, :2])).clip(0)
+        inter = wh[:, 0] * wh[:, 1]
+        iou = inter / (areas[rest] + areas[i] - inter + 1e-9)
+        ios = inter / (np.minimum(areas[rest], areas[i]) + 1e-9)
+        suppressed[rest[(iou > iou_thres) | (ios > ios_thres)]] = True
+    return det[keep]
+
+
+def detect_tiled(
+    detectors,
+    im0s,
+    paths=None,
+    save_dirs=None,
+    tile_size=640,
+    overlap=0.2,
+    region=None,
+    tile_batch=16,
+    conf_thres=0.25,
+    iou_thres=0.45,
+    max_det=1000,
+    concurrent=True,
+    stage_timer=None,
+):
+    """
+    Runs several resident models on high-resolution images split into overlapping tiles.
+
+    Each image is inferred whole, for nearby vehicles larger than a tile, and as tiles of `tile_size` pixels that
+    reach the model close to native resolution, so distant vehicles aren't shrunk below detection size. The full
+    frames and tiles of all images go through `detect_shared` in batches of `tile_batch`, and the boxes of each
+    image are merged with one global NMS. Images that fit in a single tile are only inferred whole.
+
+    Args:
+        detectors (list[Detector]): Resident models to run.
+        im0s (list[np.ndarray]): Original BGR images as HWC uint8 arrays.
+        paths (list[str] | None): Source path of each image, used to name annotated outputs.
+        save_dirs (list[str | Path | None] | None): Output directory per detector, None to skip annotation.
+        tile_size (int): Tile side in image pixels. Default is 640.
+        overlap (float): Fraction of a tile shared with its neighbours. Default is 0.2.
+        region (tuple[float, float, float, float] | None): Only tile this part of the image, as x0, y0, x1, y1
+            fractions, e.g. the far field. Default is the whole image.
+        tile_batch (int): Full frames and tiles per forward pass. Default is 16.
+        conf_thres (float): Confidence threshold for detections. Default is 0.25.
+        iou_thres (float): Intersection Over Union (IOU) threshold for the per-tile and global NMS. Default is 0.45.
+        max_det (int): Maximum number of detections per image. Default is 1000.
+        concurrent (bool): Run the models in parallel threads. Default is True.
+        stage_timer (Callable | None): As for `detect_shared`, additionally called with "merge" per detector.
+
+    Returns:
+        (list[list[Detections]]): Results indexed by detector, then by image, with boxes in original-image pixels.
+
+    Examples:
+        ```python
+        im0 = cv2.imread('data/images/intersection_4k.jpg')
+        (vehicles,), (ambulances,) = detect_tiled([vehicle_detector, ambulance_detector], [im0], region=(0, 0, 1, 0.5))
+        ```
+    """
+    stage_timer = stage_timer or (lambda stage, i: nullcontext())
+    crops, origins = [], []  # origins holds (image index, x0, y0) of each crop
+    for j, im0 in enumerate(im0s):
+        crops.append(im0)
+        origins.append((j, 0, 0))
+        for x0, y0, x1, y1 in tile_windows(im0.shape[:2], tile_size, overlap, region):
+            crops.append(np.ascontiguousarray(im0[y0:y1, x0:x1]))
+            origins.append((j, x0, y0))
+
+    boxes = [[[] for _ in im0s] for _ in detectors]
+    for start in range(0, len(crops), tile_batch):
+        results = detect_shared(
+            detectors,
+            crops[start : start + tile_batch],
+            conf_thres=conf_thres,
+            iou_thres=iou_thres,
+            max_det=max_det,
+            concurrent=concurrent,
+            stage_timer=stage_timer,
+        )
+        for i, detections in enumerate(results):
+            for (j, x0, y0), d in zip(origins[start : start + tile_batch], detections):
+                det = np.concatenate([d.boxes + [x0, y0, x0, y0], d.confidences[:, None], d.classes[:, None]], 1)
+                boxes[i][j].append(det)
+
+    save_dirs = save_dirs or [None] * len(detectors)
+    results = []
+    for i, (d, sd) in enumerate(zip(detectors, save_dirs)):
+        with stage_timer("merge", i):
+            merged = []
+            for j, im0 in enumerate(im0s):
+                det = merge_detections(np.concatenate(boxes[i][j]), iou_thres=iou_thres, max_det=max_det)
+                save_paths = []
+                if sd is not None:
+                    save_path = str(Path(sd) / (Path(paths[j]).name if paths else f"image{j}.jpg"))
+                    save_paths.append(d.annotate(im0, det, save_path))
+                merged.append(Detections.from_array(det, np.zeros(len(det)), d.names, sd, save_paths))
+        results.append(merged)
+    return results
+
+
 @smart_inference_mode()
 def run(
     weights=ROOT / "yolov5s.pt",  # model path or triton URL
@@ -147,174 +789,31 @@ def run(
         run(source='data/videos/example.mp4', weights='yolov5s.pt', conf_thres=0.4, device='0')
         ```
     """
-    source = str(source)
-    save_img = not nosave and not source.endswith(".txt")  # save inference images
-    is_file = Path(source).suffix[1:] in (IMG_FORMATS + VID_FORMATS)
-    is_url = source.lower().startswith(("rtsp://", "rtmp://", "http://", "https://"))
-    webcam = source.isnumeric() or source.endswith(".streams") or (is_url and not is_file)
-    screenshot = source.lower().startswith("screen")
-    if is_url and is_file:
-        source = check_file(source)  # download
-
-    # Directories
-    save_dir = increment_path(Path(project) / name, exist_ok=exist_ok)  # increment run
-    (save_dir / "labels" if save_txt else save_dir).mkdir(parents=True, exist_ok=True)  # make dir
-
-    # Load model
-    device = select_device(device)
-    model = DetectMultiBackend(weights, device=device, dnn=dnn, data=data, fp16=half)
-    stride, names, pt = model.stride, model.names, model.pt
-    imgsz = check_img_size(imgsz, s=stride)  # check image size
-
-    # Dataloader
-    bs = 1  # batch_size
-    if webcam:
-        view_img = check_imshow(warn=True)
-        dataset = LoadStreams(source, img_size=imgsz, stride=stride, auto=pt, vid_stride=vid_stride)
-        bs = len(dataset)
-    elif screenshot:
-        dataset = LoadScreenshots(source, img_size=imgsz, stride=stride, auto=pt)
-    else:
-        dataset = LoadImages(source, img_size=imgsz, stride=stride, auto=pt, vid_stride=vid_stride)
-    vid_path, vid_writer = [None] * bs, [None] * bs
-
-    # Run inference
-    model.warmup(imgsz=(1 if pt or model.triton else bs, 3, *imgsz))  # warmup
-    seen, windows, dt = 0, [], (Profile(device=device), Profile(device=device), Profile(device=device))
-    for path, im, im0s, vid_cap, s in dataset:
-        with dt[0]:
-            im = torch.from_numpy(im).to(model.device)
-            im = im.half() if model.fp16 else im.float()  # uint8 to fp16/32
-            im /= 255  # 0 - 255 to 0.0 - 1.0
-            if len(im.shape) == 3:
-                im = im[None]  # expand for batch dim
-            if model.xml and im.shape[0] > 1:
-                ims = torch.chunk(im, im.shape[0], 0)
-
-        # Inference
-        with dt[1]:
-            visualize = increment_path(save_dir / Path(path).stem, mkdir=True) if visualize else False
-            if model.xml and im.shape[0] > 1:
-                pred = None
-                for image in ims:
-                    if pred is None:
-                        pred = model(image, augment=augment, visualize=visualize).unsqueeze(0)
-                    else:
-                        pred = torch.cat((pred, model(image, augment=augment, visualize=visualize).unsqueeze(0)), dim=0)
-                pred = [pred, None]
-            else:
-                pred = model(im, augment=augment, visualize=visualize)
-        # NMS
-        with dt[2]:
-            pred = non_max_suppression(pred, conf_thres, iou_thres, classes, agnostic_nms, max_det=max_det)
-
-        # Second-stage classifier (optional)
-        # pred = utils.general.apply_classifier(pred, classifier_model, im, im0s)
-
-        # Define the path for the CSV file
-        csv_path = save_dir / "predictions.csv"
-
-        # Create or append to the CSV file
-        def write_to_csv(image_name, prediction, confidence, frame):
-            """Writes prediction data for an image to a CSV file, appending if the file exists."""
-            data = {"Image Name": image_name, "Prediction": prediction, "Confidence": confidence, "Frame" : frame}
-            with open(csv_path, mode="a", newline="") as f:
-                writer = csv.DictWriter(f, fieldnames=data.keys())
-                if not csv_path.is_file():
-                    writer.writeheader()
-                writer.writerow(data)
-
-        # Process predictions
-        for i, det in enumerate(pred):  # per image
-            seen += 1
-            if webcam:  # batch_size >= 1
-                p, im0, frame = path[i], im0s[i].copy(), dataset.count
-                s += f"{i}: "
-            else:
-                p, im0, frame = path, im0s.copy(), getattr(dataset, "frame", 0)
-
-            p = Path(p)  # to Path
-            save_path = str(save_dir / p.name)  # im.jpg
-            txt_path = str(save_dir / "labels" / p.stem) + ("" if dataset.mode == "image" else f"_{frame}")  # im.txt
-            s += "{:g}x{:g} ".format(*im.shape[2:])  # print string
-            gn = torch.tensor(im0.shape)[[1, 0, 1, 0]]  # normalization gain whwh
-            imc = im0.copy() if save_crop else im0  # for save_crop
-            annotator = Annotator(im0, line_width=line_thickness, example=str(names))
-            if len(det):
-                # Rescale boxes from img_size to im0 size
-                det[:, :4] = scale_boxes(im.shape[2:], det[:, :4], im0.shape).round()
-
-                # Print results
-                for c in det[:, 5].unique():
-                    n = (det[:, 5] == c).sum()  # detections per class
-                    s += f"{n} {names[int(c)]}{'s' * (n > 1)}, "  # add to string
-
-                # Write results
-                for *xyxy, conf, cls in reversed(det):
-                    c = int(cls)  # integer class
-                    label = names[c] if hide_conf else f"{names[c]}"
-                    confidence = float(conf)
-                    confidence_str = f"{confidence:.2f}"
-
-                    if save_csv:
-                        write_to_csv(p.name, label, confidence_str, frame)
-
-                    if save_txt:  # Write to file
-                        if save_format == 0:
-                            coords = (
-                                (xyxy2xywh(torch.tensor(xyxy).view(1, 4)) / gn).view(-1).tolist()
-                            )  # normalized xywh
-                        else:
-                            coords = (torch.tensor(xyxy).view(1, 4) / gn).view(-1).tolist()  # xyxy
-                        line = (cls, *coords, conf) if save_conf else (cls, *coords)  # label format
-                        with open(f"{txt_path}.txt", "a") as f:
-                            f.write(("%g " * len(line)).rstrip() % line + "\n")
-
-                    if save_img or save_crop or view_img:  # Add bbox to image
-                        c = int(cls)  # integer class
-                        label = None if hide_labels else (names[c] if hide_conf else f"{names[c]} {conf:.2f}")
-                        annotator.box_label(xyxy, label, color=colors(c, True))
-                    if save_crop:
-                        save_one_box(xyxy, imc, file=save_dir / "crops" / names[c] / f"{p.stem}.jpg", BGR=True)
-
-            # Stream results
-            im0 = annotator.result()
-            if view_img:
-                if platform.system() == "Linux" and p not in windows:
-                    windows.append(p)
-                    cv2.namedWindow(str(p), cv2.WINDOW_NORMAL | cv2.WINDOW_KEEPRATIO)  # allow window resize (Linux)
-                    cv2.resizeWindow(str(p), im0.shape[1], im0.shape[0])
-                cv2.imshow(str(p), im0)
-                cv2.waitKey(1)  # 1 millisecond
-
-            # Save results (image with detections)
-            if save_img:
-                if dataset.mode == "image":
-                    cv2.imwrite(save_path, im0)
-                else:  # 'video' or 'stream'
-                    if vid_path[i] != save_path:  # new video
-                        vid_path[i] = save_path
-                        if isinstance(vid_writer[i], cv2.VideoWriter):
-                            vid_writer[i].release()  # release previous video writer
-                        if vid_cap:  # video
-                            fps = vid_cap.get(cv2.CAP_PROP_FPS)
-                            w = int(vid_cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                            h = int(vid_cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                        else:  # stream
-                            fps, w, h = 30, im0.shape[1], im0.shape[0]
-                        save_path = str(Path(save_path).with_suffix(".mp4"))  # force *.mp4 suffix on results videos
-                        vid_writer[i] = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (w, h))
-                    vid_writer[i].write(im0)
-
-        # Print time (inference-only)
-        LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{dt[1].dt * 1E3:.1f}ms")
-
-    # Print results
-    t = tuple(x.t / seen * 1e3 for x in dt)  # speeds per image
-    LOGGER.info(f"Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS per image at shape {(1, 3, *imgsz)}" % t)
-    if save_txt or save_img:
-        s = f"\n{len(list(save_dir.glob('labels/*.txt')))} labels saved to {save_dir / 'labels'}" if save_txt else ""
-        LOGGER.info(f"Results saved to {colorstr('bold', save_dir)}{s}")
+    detector = Detector(weights, data=data, imgsz=imgsz, device=device, half=half, dnn=dnn)
+    detector.run(
+        source=source,
+        conf_thres=conf_thres,
+        iou_thres=iou_thres,
+        max_det=max_det,
+        view_img=view_img,
+        save_txt=save_txt,
+        save_format=save_format,
+        save_csv=save_csv,
+        save_conf=save_conf,
+        save_crop=save_crop,
+        nosave=nosave,
+        classes=classes,
+        agnostic_nms=agnostic_nms,
+        augment=augment,
+        visualize=visualize,
+        project=project,
+        name=name,
+        exist_ok=exist_ok,
+        line_thickness=line_thickness,
+        hide_labels=hide_labels,
+        hide_conf=hide_conf,
+        vid_stride=vid_stride,
+    )
     if update:
         strip_optimizer(weights[0])  # update model (to fix SourceChangeWarning)
 
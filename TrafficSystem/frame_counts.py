@@ -0,0 +1,64 @@
+import numpy as np
+
+
+class FrameCountAggregator:
+    """
+    Running per-class statistics of how many boxes each frame contains, updated one frame at a time.
+    State is O(classes): per-class sums and maxima plus a bounded histogram of per-frame counts,
+    so statistics are available at any point while a video or stream is still being processed.
+    """
+
+    def __init__(self, num_classes, max_count=255):
+        self.num_classes = num_classes
+        self.max_count = max_count
+        self.frames = 0
+        self.sums = np.zeros(num_classes, dtype=np.int64)
+        self.present = np.zeros(num_classes, dtype=np.int64)  # frames each class appears in
+        self.maxima = np.zeros(num_classes, dtype=np.int64)
+        # histogram[c, k] = number of frames with k boxes of class c, counts above max_count share the last bin
+        self.histogram = np.zeros((num_classes, max_count + 1), dtype=np.int64)
+
+    def update(self, classes):
+        """
+        Add one frame given the class index of every box detected in it
+        """
+        counts = np.bincount(np.asarray(classes, dtype=np.int64), minlength=self.num_classes)
+        self.frames += 1
+        self.sums += counts
+        self.present += counts > 0
+        np.maximum(self.maxima, counts, out=self.maxima)
+        self.histogram[np.arange(self.num_classes), np.minimum(counts, self.max_count)] += 1
+
+    def means(self, present_only=False):
+        """
+        Mean boxes per frame for each class, optionally only over the frames the class appears in
+        """
+        frames = self.present if present_only else np.full(self.num_classes, self.frames)
+        return np.divide(self.sums, frames, out=np.zeros(self.num_classes), where=frames > 0)
+
+    def percentiles(self, q):
+        """
+        q-th percentile of the per-frame count for each class, read from the histogram
+        """
+        if self.frames == 0:
+            return np.zeros(self.num_classes, dtype=np.int64)
+        cdf = self.histogram.cumsum(axis=1)
+        return (cdf < q / 100 * self.frames).sum(axis=1)
+
+    def stats(self, names):
+        means, present_means = self.means(), self.means(present_only=True)
+        p50, p95, p99 = self.percentiles(50), self.percentiles(95), self.percentiles(99)
+        return {
+            "frames": self.frames,
+            "classes": {
+                names[c]: {
+                    "mean": float(means[c]),
+                    "mean_when_present": float(present_means[c]),
+                    "max": int(self.maxima[c]),
+                    "p50": int(p50[c]),
+                    "p95": int(p95[c]),
+                    "p99": int(p99[c]),
+                }
+                for c in np.flatnonzero(self.present)
+            },
+        }
@@ -0,0 +1,335 @@
+import asyncio
+import cProfile
+import json
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+job_seconds = metrics.registry.register(metrics.Histogram(
+    "traffic_inference_job_seconds", "Time from submitting an inference job until it finished", ["job", "status"]
+))
+batch_size = metrics.registry.register(metrics.Histogram(
+    "traffic_inference_batch_size", "Jobs coalesced into each batch sent to the workers", ["job"],
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+))
+
+
+class QueueFullError(Exception):
+    """
+    Raised when every worker is busy and the job queue has no room left
+    """
+
+
+def _init_worker(vehicle_weights, ambulance_weights):
+    from yolo_module import configure_weights, load_detectors
+
+    # Each worker process loads the models once and keeps them for its lifetime
+    configure_weights(vehicle_weights, ambulance_weights)
+    metrics.buffer_observations()
+    load_detectors()
+
+
+def _ping():
+    return True
+
+
+def _run_job(fn, profile_path, *args, **kwargs):
+    import yolo_module
+
+    # The stage timings of the job travel back with its result, to be observed in the main process
+    fn = getattr(yolo_module, fn)
+    metrics.drain()
+    if profile_path is None:
+        return fn(*args, **kwargs), metrics.drain()
+    profiler = cProfile.Profile()
+    try:
+        result = profiler.runcall(fn, *args, **kwargs)
+    finally:
+        profiler.dump_stats(profile_path)
+    return result, metrics.drain()
+
+
+def stage_totals(observations):
+    """
+    Total seconds per "model-stage" name of a job's (stage, model, seconds) observations
+    """
+    totals = {}
+    for stage, model, seconds in observations:
+        name = f"{model}-{stage}" if model else stage
+        totals[name] = totals.get(name, 0.0) + seconds
+    return totals
+
+
+class InferencePool:
+    """
+    Bounded pool of worker processes with the detection models preloaded.
+    Jobs are tracked by id so callers can return immediately and poll for the result.
+    With shared_jobs set to a mapping shared between server processes, jobs can be polled from any of them.
+    Jobs submitted with submit_batched() wait up to batch_wait seconds for others of the same function and run in
+    the worker as one call with up to batch_size items, each job still getting its own result.
+    Long jobs can report progress through a file in progress_dir named after the job id, shown while they run.
+    """
+
+    def __init__(
+        self, workers, max_queue, timeout, job_ttl=600, start_method="spawn", batch_size=1, batch_wait=0.0,
+        progress_dir="progress"
+    ):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.job_ttl = job_ttl
+        self.start_method = start_method
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.progress_dir = Path(progress_dir)
+        self.executor = None
+        self.warmup = []
+        self.jobs = {}
+        self.shared_jobs = None
+        self.active = 0
+        self.batches = {}  # fn: (jobs, items, on_dones, profile paths, flush timer) waiting to be sent
+
+    @property
+    def capacity(self):
+        return self.workers + self.max_queue
+
+    def start(self, vehicle_weights, ambulance_weights):
+        self.progress_dir.mkdir(parents=True, exist_ok=True)
+        context = multiprocessing.get_context(self.start_method)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(vehicle_weights, ambulance_weights),
+        )
+        # Spin every worker up now so the first uploads don't pay for loading the models
+        self.warmup = [self.executor.submit(_ping) for _ in range(self.workers)]
+        logger.info(f"Started {self.workers} inference workers, queue size {self.max_queue}")
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, fn, *args, on_done=None, timeout=None, profile_path=None, progress=False):
+        """
+        Queue fn(*args) on a worker and return the job id. fn names a function of yolo_module, which is only
+        imported in the workers.
+        on_done runs in the event loop with the worker's result and its return value becomes the job result.
+        timeout overrides the pool's default for long jobs such as videos.
+        profile_path makes the worker run the job under cProfile and write the stats there.
+        progress passes fn a progress_path to write JSON snapshots to, the latest is the job's progress until it ends.
+        """
+        if self.active >= self.capacity:
+            raise QueueFullError(f"Inference queue is full ({self.active} jobs in flight)")
+        self._prune()
+
+        job = self._new_job(fn)
+        kwargs = {"progress_path": str(self._progress_path(job["job_id"]))} if progress else {}
+        future = self.executor.submit(_run_job, fn, profile_path, *args, **kwargs)
+        job["future"] = future
+        self.active += 1
+        self._share(job)
+        asyncio.ensure_future(self._track([job], future, [on_done], timeout or self.timeout))
+        return job["job_id"]
+
+    def submit_batched(self, fn, item, on_done=None, profile_path=None):
+        """
+        Queue one item for fn, which takes a list of items and returns a list with one result per item, and return
+        the job id. The item is sent with the others queued for fn within batch_wait seconds, or as soon as
+        batch_size items are waiting. on_done runs with this item's result, and an item whose result is an exception
+        fails only its own job. A batch takes its capacity slot when its first item arrives, so the queue limit
+        counts worker calls and a full queue still takes items into a batch that is waiting.
+        """
+        if fn not in self.batches and self.active >= self.capacity:
+            raise QueueFullError(f"Inference queue is full ({self.active} jobs in flight)")
+        self._prune()
+
+        job = self._new_job(fn)
+        self._share(job)
+        if fn not in self.batches:
+            self.active += 1
+            timer = asyncio.get_running_loop().call_later(self.batch_wait, self._flush, fn)
+            self.batches[fn] = ([], [], [], [], timer)
+        jobs, items, on_dones, profile_paths, _ = self.batches[fn]
+        jobs.append(job)
+        items.append(item)
+        on_dones.append(on_done)
+        profile_paths.append(profile_path)
+        if len(items) >= self.batch_size:
+            self._flush(fn)
+        return job["job_id"]
+
+    def _flush(self, fn):
+        if fn not in self.batches:
+            return
+        jobs, items, on_dones, profile_paths, timer = self.batches.pop(fn)
+        timer.cancel()
+        # The batch is profiled if any of its jobs asked to be
+        profile_path = next((path for path in profile_paths if path is not None), None)
+        try:
+            future = self.executor.submit(_run_job, fn, profile_path, items)
+        except Exception as e:
+            self.active -= 1
+            for job in jobs:
+                self._finish(job, "failed", error=str(e))
+            return
+        flushed_at = time.time()
+        for job in jobs:
+            job.update({"future": future, "batch_size": len(items), "batch_wait": flushed_at - job["submitted_at"]})
+        batch_size.observe(len(items), job=fn)
+        asyncio.ensure_future(self._track(jobs, future, on_dones, self.timeout, batched=True))
+
+    def _new_job(self, fn):
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "name": fn,
+            "status": "queued",
+            "result": None,
+            "error": None,
+            "stages": {},
+            "submitted_at": time.time(),
+            "finished_at": None,
+            "future": None,
+            "batch_size": 1,
+            "batch_wait": 0.0,
+            "event": asyncio.Event(),
+        }
+        self.jobs[job_id] = job
+        return job
+
+    def get(self, job_id):
+        """
+        Return the public view of a job, or None if it is unknown or expired
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            shared = self.shared_jobs.get(job_id) if self.shared_jobs is not None else None
+            if shared is not None and shared["finished_at"] is None:
+                shared = {**shared, "progress": self._progress(job_id)}  # the worker writes it, not the owner
+            return shared
+        status = job["status"]
+        if status == "queued" and job["future"] is not None and job["future"].running():
+            status = "running"
+        return {
+            "job_id": job_id,
+            "status": status,
+            "result": job["result"],
+            "error": job["error"],
+            "progress": self._progress(job_id) if job["finished_at"] is None else None,
+            "stages": job["stages"],
+            "batch_size": job["batch_size"],
+            "submitted_at": job["submitted_at"],
+            "finished_at": job["finished_at"],
+        }
+
+    def stats(self):
+        """
+        Worker calls currently queued and running, calls still holding a capacity slot after timing out count as
+        running. Jobs waiting for their batch to be sent count as batching, their batch already holds a slot.
+        """
+        pending = [job for job in self.jobs.values() if job["status"] == "queued"]
+        futures = {id(job["future"]): job["future"] for job in pending if job["future"] is not None}
+        running = sum(future.running() for future in futures.values())
+        return {
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "in_flight": self.active,
+            "running": running + self.active - len(futures) - len(self.batches),
+            "queued": len(futures) - running,
+            "batching": sum(len(batch[0]) for batch in self.batches.values()),
+        }
+
+    def worker_pids(self):
+        if self.executor is None:
+            return []
+        return [process.pid for process in (self.executor._processes or {}).values()]
+
+    async def wait_ready(self):
+        """
+        Wait until the workers have loaded the models
+        """
+        await asyncio.gather(*(asyncio.wrap_future(future) for future in self.warmup))
+
+    async def wait(self, job_id):
+        await self.jobs[job_id]["event"].wait()
+        return self.get(job_id)
+
+    async def _track(self, jobs, future, on_dones, timeout, batched=False):
+        """
+        Finish the jobs sharing one worker call, a batched call returns one result per job
+        """
+        wrapped = asyncio.wrap_future(future)
+        try:
+            result, observations = await asyncio.wait_for(asyncio.shield(wrapped), timeout)
+            metrics.merge(observations)
+            stages = stage_totals(observations)
+            for job, on_done, job_result in zip(jobs, on_dones, result if batched else [result]):
+                job["stages"] = {**stages, "batch-wait": job["batch_wait"]} if batched else stages
+                if batched and isinstance(job_result, Exception):
+                    # One bad item only fails its own job, the rest of the batch still completes
+                    self._finish(job, "failed", error=str(job_result))
+                    continue
+                try:
+                    if on_done is not None:
+                        job_result = on_done(job_result)
+                    self._finish(job, "done", result=job_result)
+                except Exception as e:
+                    logger.error(f"Inference job {job['job_id']} failed: {e}")
+                    self._finish(job, "failed", error=str(e))
+        except asyncio.TimeoutError:
+            for job in jobs:
+                self._finish(job, "timeout", error=f"Inference did not finish within {timeout}s")
+            # A running worker can't be interrupted, so it keeps counting against capacity until it returns
+            if not future.cancel():
+                await asyncio.gather(wrapped, return_exceptions=True)
+        except Exception as e:
+            logger.error(f"Inference job {', '.join(job['job_id'] for job in jobs)} failed: {e}")
+            for job in jobs:
+                self._finish(job, "failed", error=str(e))
+        finally:
+            self.active -= 1
+            # Only once the worker returned, a job that timed out can still be writing its progress
+            for job in jobs:
+                try:
+                    os.remove(self._progress_path(job["job_id"]))
+                except OSError:
+                    pass
+
+    def _progress_path(self, job_id):
+        return self.progress_dir / f"{job_id}.json"
+
+    def _progress(self, job_id):
+        """
+        Latest progress snapshot the job's worker wrote, None before the first one
+        """
+        try:
+            return json.loads(self._progress_path(job_id).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _finish(self, job, status, result=None, error=None):
+        job.update({"status": status, "result": result, "error": error, "finished_at": time.time()})
+        job["event"].set()
+        self._share(job)
+        job_seconds.observe(job["finished_at"] - job["submitted_at"], job=job["name"], status=status)
+
+    def _prune(self):
+        expiry = time.time() - self.job_ttl
+        expired = [job_id for job_id, job in self.jobs.items() if job["finished_at"] and job["finished_at"] < expiry]
+        for job_id in expired:
+            del self.jobs[job_id]
+            if self.shared_jobs is not None:
+                self.shared_jobs.pop(job_id, None)
+
+    def _share(self, job):
+        if self.shared_jobs is not None:
+            self.shared_jobs[job["job_id"]] = self.get(job["job_id"])
@@ -1,23 +1,54 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi import APIRouter, Request, Form    
-from fastapi.responses import HTMLResponse, RedirectResponse,FileResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Request, Form, Header, Depends, Query, Response
+from fastapi.responses import HTMLResponse, RedirectResponse,FileResponse, JSONResponse, PlainTextResponse
+from fastapi.responses import StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List
-import cv2
-import numpy as np
-import base64
+from typing import List, Optional
 from datetime import datetime
 import uvicorn
 import os,subprocess
+import re
 import time
+import asyncio
 
 import logging
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
+from starlette.concurrency import run_in_threadpool
 
-from yolo_module import *
+# torch and the models are only imported by the inference workers, or by this process once a stream is registered
+from config import INFERENCE_WORKERS, INFERENCE_QUEUE_SIZE, INFERENCE_TIMEOUT, INFERENCE_START_METHOD, JOB_TTL
+from config import INFERENCE_BATCH_SIZE, INFERENCE_BATCH_WAIT, JOB_PROGRESS_DIR
+from config import RUNS_DIR, UPLOADS_DIR, PERSIST_UPLOADS, RETENTION_INTERVAL
+from config import VEHICLE_WEIGHTS, AMBULANCE_WEIGHTS, CONF_THRES, IMG_SIZE, RESULT_CACHE_ENTRIES, RESULT_CACHE_BYTES
+from config import TILE_SIZE, TILE_OVERLAP, TILE_REGION
+from config import RUNS_MAX_AGE, RUNS_MAX_COUNT, RUNS_MAX_BYTES, UPLOADS_MAX_AGE, UPLOADS_MAX_COUNT, UPLOADS_MAX_BYTES
+from inference_pool import InferencePool, QueueFullError
+from retention import RetentionCollector, RetentionPolicy
+from result_cache import ResultCache
+from config import STREAM_SAMPLE_FPS, STREAM_WINDOW, STREAM_RECONNECT_DELAY
+from config import VIDEO_MAX_BYTES, VIDEO_TIMEOUT, MOTION_GATE_THRESHOLD, MOTION_GATE_MAX_SKIP
+from stream_ingest import StreamIngestor
+from motion_gate import MotionGate
+from config import MODEL_BACKEND, MODEL_BACKEND_CANDIDATES, MODEL_CALIBRATION_DIR, MODEL_MAX_COUNT_DELTA
+from config import MODEL_BENCHMARK_RUNS
+from model_export import resolve_in_subprocess
+import metrics
+import server_timing
+from profiler import RequestProfiler
+from signal_store import SignalDatabase, SignalStore
+from config import SIGNAL_DB, SIGNAL_FLUSH_INTERVAL, SIGNALS_PAGE_SIZE, SIGNALS_MAX_PAGE_SIZE
+from signal_events import SignalEventBroker
+from config import SIGNAL_EVENTS_INTERVAL, SIGNAL_EVENTS_QUEUE, SIGNAL_EVENTS_HEARTBEAT
+from config import ADMIN_TOKEN, PROFILES_DIR
+from signal_timing import WebsterTiming
+from config import TIMING_SATURATION_FLOW, TIMING_LOST_TIME, TIMING_MIN_GREEN, TIMING_MAX_GREEN, TIMING_MIN_CYCLE
+from config import TIMING_MAX_CYCLE, TIMING_PREEMPT_GREEN, TIMING_COUNT_INTERVAL
+from signal_scheduler import SignalScheduler
+from config import SIGNAL_CYCLES
+import secrets
 # app = APIRouter()
 
 
@@ -51,18 +82,73 @@ class SignalUpdate(BaseModel):
     timings: List[SignalTiming]
     total_time: int
 
-# Store signal data in memory (in production, use a database)
-signals = {
-    1: {"name": "North Signal", "vehicle_count": 0, "timing": 0, "image_path": None, "ambulance_count": 0},
-    2: {"name": "South Signal", "vehicle_count": 0, "timing": 0, "image_path": None, "ambulance_count": 0},
-    3: {"name": "East Signal", "vehicle_count": 0, "timing": 0, "image_path": None, "ambulance_count": 0},
-    4: {"name": "West Signal", "vehicle_count": 0, "timing": 0, "image_path": None, "ambulance_count": 0},
-}
+class StreamConfig(BaseModel):
+    url: str
+
+class IntersectionCreate(BaseModel):
+    name: str
+    signals: List[str]
+
+class Lane(BaseModel):
+    name: str
+    points: List[List[float]]  # [x, y] vertices as fractions of the frame width and height
+
+class SignalROI(BaseModel):
+    lanes: List[Lane]
+
+class TimingPlan(BaseModel):
+    intersection_ids: Optional[List[int]] = None  # every intersection when omitted
+    cycle: Optional[float] = None  # Webster's cycle for each intersection when omitted
+
+# State of a newly registered signal
+NEW_SIGNAL = {"vehicle_count": 0, "timing": 0, "image_path": None, "ambulance_count": 0}
+
+# Signal state is served from memory and persisted to SQLite, shared between workers by share_state.
+# The database is seeded with a single four-way intersection.
+signals = SignalStore.open(SignalDatabase(SIGNAL_DB), {
+    1: ("Main Intersection", {
+        1: {"name": "North Signal", "vehicle_count": 0, "timing": 0, "image_path": None, "ambulance_count": 0},
+        2: {"name": "South Signal", "vehicle_count": 0, "timing": 0, "image_path": None, "ambulance_count": 0},
+        3: {"name": "East Signal", "vehicle_count": 0, "timing": 0, "image_path": None, "ambulance_count": 0},
+        4: {"name": "West Signal", "vehicle_count": 0, "timing": 0, "image_path": None, "ambulance_count": 0},
+    }),
+})
+
+@app.on_event("startup")
+async def start_signal_flusher():
+    app.state.signal_flusher = asyncio.create_task(signals.run_flusher(SIGNAL_FLUSH_INTERVAL))
+
+@app.on_event("shutdown")
+async def stop_signal_flusher():
+    app.state.signal_flusher.cancel()
+    await asyncio.gather(app.state.signal_flusher, return_exceptions=True)
+
+# Each server process pushes signal changes to its own connected dashboards
+signal_events = None
+
+@app.on_event("startup")
+async def start_signal_events():
+    # Created here rather than at import so a pre-forked worker uses the store shared by share_state
+    global signal_events
+    signal_events = SignalEventBroker(signals, SIGNAL_EVENTS_INTERVAL, SIGNAL_EVENTS_QUEUE, SIGNAL_EVENTS_HEARTBEAT)
+    signal_events.start(asyncio.get_running_loop())
+    app.state.signal_events_task = asyncio.create_task(signal_events.run())
+
+@app.on_event("shutdown")
+async def stop_signal_events():
+    signal_events.stop()
+    app.state.signal_events_task.cancel()
 
 
 # Create uploads directory if it doesn't exist
-if not os.path.exists("uploads"):
-    os.makedirs("uploads")
+if not os.path.exists(UPLOADS_DIR):
+    os.makedirs(UPLOADS_DIR)
+
+# Detection runs in worker processes so the event loop keeps serving other requests
+inference_pool = InferencePool(
+    INFERENCE_WORKERS, INFERENCE_QUEUE_SIZE, INFERENCE_TIMEOUT, job_ttl=JOB_TTL, start_method=INFERENCE_START_METHOD,
+    batch_size=INFERENCE_BATCH_SIZE, batch_wait=INFERENCE_BATCH_WAIT, progress_dir=JOB_PROGRESS_DIR,
+)
 
 # def detect_vehicles_and_ambulance(image_path):
 #     """
@@ -75,6 +161,37 @@ if not os.path.exists("uploads"):
 #     ambulance_detected = np.random.random() < 0.2  # 20% chance of ambulance detection
 #     return vehicle_count, ambulance_detected
 
+def share_state(manager):
+    """
+    Move the signal state and job statuses into a multiprocessing manager so every pre-forked worker sees them
+    """
+    global signals
+    signals = signals.share(manager)
+    inference_pool.shared_jobs = manager.dict()
+
+signal_timing = WebsterTiming(
+    TIMING_SATURATION_FLOW, TIMING_LOST_TIME, TIMING_MIN_GREEN, TIMING_MAX_GREEN, TIMING_MIN_CYCLE, TIMING_MAX_CYCLE,
+    TIMING_PREEMPT_GREEN, TIMING_COUNT_INTERVAL
+)
+
+# The red/yellow/green cycle of every intersection, re-planned from the latest counts at each green.
+# A phase change takes the lost time of the timing plan, spent on yellow.
+signal_scheduler = None
+
+@app.on_event("startup")
+async def start_signal_scheduler():
+    # serve.py runs the cycles in its first worker only, the others see the phase changes through the shared store
+    global signal_scheduler
+    if not getattr(app.state, "signal_cycles", SIGNAL_CYCLES):
+        return
+    signal_scheduler = SignalScheduler(signals, signal_timing, yellow=TIMING_LOST_TIME)
+    app.state.signal_scheduler_task = asyncio.create_task(signal_scheduler.run())
+
+@app.on_event("shutdown")
+async def stop_signal_scheduler():
+    if signal_scheduler is not None:
+        app.state.signal_scheduler_task.cancel()
+
 def calculate_priority_timing(signal_data, total_time):
     """
     Calculate signal timing with ambulance priority
@@ -87,6 +204,291 @@ def calculate_priority_timing(signal_data, total_time):
     
     return base_timing
 
+# Benchmark report per weights file when MODEL_BACKEND is auto
+model_reports = {}
+
+def prepare_models():
+    """
+    Resolve the model files to serve, exporting or benchmarking the CPU backends as configured. That happens in a
+    process of its own, so torch and the benchmarked models aren't left loaded in the server
+    """
+    if MODEL_BACKEND == "pt":
+        return [VEHICLE_WEIGHTS, AMBULANCE_WEIGHTS]
+    selected, reports = resolve_in_subprocess(
+        [VEHICLE_WEIGHTS, AMBULANCE_WEIGHTS],
+        MODEL_BACKEND,
+        MODEL_BACKEND_CANDIDATES,
+        IMG_SIZE,
+        CONF_THRES,
+        calibration_dir=MODEL_CALIBRATION_DIR,
+        max_count_delta=MODEL_MAX_COUNT_DELTA,
+        runs=MODEL_BENCHMARK_RUNS,
+    )
+    model_reports.update(reports)
+    return selected
+
+async def warm_up():
+    """
+    Resolve the model files and start the inference workers, each loads the detection models once.
+    Runs in the background so the server answers /ready straight away instead of after the models are loaded.
+    """
+    try:
+        if not hasattr(app.state, "model_weights"):  # serve.py resolves them before forking the workers
+            app.state.model_weights = await run_in_threadpool(prepare_models)
+        inference_pool.start(*app.state.model_weights)
+        await inference_pool.wait_ready()
+        app.state.ready = True
+        logger.info("Inference workers are ready")
+    except Exception as e:
+        logger.error(f"Loading the models failed: {e}")
+        app.state.warmup_error = str(e)
+
+@app.on_event("startup")
+async def start_inference_pool():
+    app.state.ready = False
+    app.state.warmup_error = None
+    app.state.warmup_task = asyncio.create_task(warm_up())
+
+@app.on_event("shutdown")
+def stop_inference_pool():
+    inference_pool.shutdown()
+
+def weights_version(path):
+    return path, os.path.getmtime(path) if os.path.exists(path) else None
+
+# Repeated frames are answered from the cache, keyed on the image bytes plus everything that affects the result
+result_cache = ResultCache(RESULT_CACHE_ENTRIES, RESULT_CACHE_BYTES)
+detection_params = (
+    weights_version(VEHICLE_WEIGHTS), weights_version(AMBULANCE_WEIGHTS), MODEL_BACKEND, CONF_THRES, IMG_SIZE,
+    TILE_SIZE, TILE_OVERLAP, TILE_REGION,
+)
+
+def cache_result(cache_key, result):
+    vehicle_count, detect_vehicle_file, ambulance_count, ambulance_detect_vehicle_file, lane_counts = result
+    result_cache.put(cache_key, result, paths=[detect_vehicle_file, ambulance_detect_vehicle_file])
+    return result
+
+# Old detection runs and uploads are evicted in the background, never the images currently on display. Cached
+# results are not kept alive, the entries whose runs were removed are dropped from the cache instead.
+retention_collector = RetentionCollector(
+    RUNS_DIR,
+    RetentionPolicy(RUNS_MAX_AGE, RUNS_MAX_COUNT, RUNS_MAX_BYTES),
+    UPLOADS_DIR,
+    RetentionPolicy(UPLOADS_MAX_AGE, UPLOADS_MAX_COUNT, UPLOADS_MAX_BYTES),
+    interval=RETENTION_INTERVAL,
+    keep=lambda: [signal["image_path"] for signal in signals.all().values()],
+    on_removed=result_cache.prune,
+)
+
+@app.on_event("startup")
+async def start_retention_collector():
+    app.state.retention_task = asyncio.create_task(retention_collector.run())
+
+@app.on_event("shutdown")
+async def stop_retention_collector():
+    app.state.retention_task.cancel()
+
+def apply_stream_counts(signal_id, vehicle_count, ambulance_count, image_path):
+    """
+    Record a stream sample, image_path is None when the motion gate skipped the frame and the last image still applies
+    """
+    if signal_id in signals:
+        fields = {
+            "vehicle_count": vehicle_count,
+            "ambulance_count": ambulance_count,
+            "stream_seen_at": time.time(),  # tells a static scene from a stream that stopped delivering frames
+        }
+        if image_path is not None:
+            fields["image_path"] = image_path
+            fields["image_version"] = time.time_ns()  # every sample overwrites the same file
+        signals.update(signal_id, fields)
+
+def load_stream_detectors():
+    import yolo_module
+
+    yolo_module.configure_weights(*app.state.model_weights)
+    return yolo_module.load_detectors()
+
+# Registered camera streams are sampled in the background and share one batched copy of the models
+stream_ingestor = StreamIngestor(
+    load_stream_detectors,
+    CONF_THRES,
+    RUNS_DIR / "streams",
+    sample_fps=STREAM_SAMPLE_FPS,
+    window=STREAM_WINDOW,
+    reconnect_delay=STREAM_RECONNECT_DELAY,
+    gate=MotionGate(MOTION_GATE_THRESHOLD, max_skip=MOTION_GATE_MAX_SKIP) if MOTION_GATE_THRESHOLD > 0 else None,
+    on_update=apply_stream_counts,
+)
+
+@app.on_event("startup")
+async def start_stream_ingestor():
+    stream_ingestor.start(asyncio.get_running_loop())
+
+@app.on_event("shutdown")
+def stop_stream_ingestor():
+    stream_ingestor.stop()
+
+# Usernames name the per-user uploads directory, so they must not be able to reach outside it
+USERNAME_PATTERN = re.compile(r"[A-Za-z0-9_-]+")
+
+def check_username(username):
+    if not USERNAME_PATTERN.fullmatch(username):
+        raise HTTPException(status_code=400, detail="username may only contain letters, digits, '_' and '-'")
+
+def upload_location(username, filename):
+    """
+    Where an upload is kept, under the user's directory and with any directories in filename dropped
+    """
+    return str(UPLOADS_DIR / username / (os.path.basename(filename) or "upload"))
+
+def save_upload(file_location, contents):
+    os.makedirs(os.path.dirname(file_location), exist_ok=True)
+    with open(file_location, "wb+") as file_object:
+        file_object.write(contents)
+
+def submit_job(fn, *args, on_done=None, timeout=None, batched=False, progress=False):
+    """
+    Queue a yolo_module function on the inference workers. With batched, args is a single item that is coalesced
+    with concurrent jobs of the same function into one call. With progress, fn reports running statistics that
+    /jobs/{job_id} shows while the job runs.
+    """
+    if inference_pool.executor is None:
+        raise HTTPException(status_code=503, detail="The models are still loading", headers={"Retry-After": "5"})
+    try:
+        if batched:
+            (item,) = args
+            return inference_pool.submit_batched(
+                fn, item, on_done=on_done, profile_path=request_profiler.job_profile_path()
+            )
+        return inference_pool.submit(
+            fn, *args, on_done=on_done, timeout=timeout, profile_path=request_profiler.job_profile_path(),
+            progress=progress
+        )
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+async def job_response(job_id, wait):
+    """
+    Return the job id straight away, or wait for the job and return its result
+    """
+    if not wait:
+        return JSONResponse(status_code=202, content={"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"})
+    job = await inference_pool.wait(job_id)
+    server_timing.add_stages(job["stages"])
+    server_timing.add("job", job["finished_at"] - job["submitted_at"])
+    if job["status"] == "timeout":
+        raise HTTPException(status_code=504, detail=job["error"])
+    if job["status"] != "done":
+        raise HTTPException(status_code=500, detail=job["error"])
+    return {**job["result"], "job_id": job_id}
+
+http_request_seconds = metrics.registry.register(metrics.Histogram(
+    "traffic_http_request_seconds", "HTTP request latency per route", ["method", "route"]
+))
+signal_requests = metrics.registry.register(metrics.Counter(
+    "traffic_signal_requests_total", "Requests per signal and route", ["signal_id", "route"]
+))
+signal_errors = metrics.registry.register(metrics.Counter(
+    "traffic_signal_errors_total", "Failed requests per signal and route", ["signal_id", "route", "status"]
+))
+metrics.registry.register(metrics.Gauge(
+    "traffic_inference_jobs", "Inference jobs by state", ["state"],
+    collect=lambda: {(state,): value for state, value in inference_pool.stats().items()},
+))
+metrics.registry.register(metrics.Gauge(
+    "traffic_signal_event_subscribers", "Dashboards connected to /signals/events in this process", [],
+    collect=lambda: {(): signal_events.stats()["subscribers"] if signal_events is not None else 0},
+))
+metrics.registry.register(metrics.Gauge(
+    "traffic_result_cache", "Detection result cache counters and size", ["stat"],
+    collect=lambda: {(stat,): value for stat, value in result_cache.stats().items()},
+))
+
+def process_memory():
+    processes = {("main",): metrics.resident_memory()}
+    for i, pid in enumerate(inference_pool.worker_pids()):
+        processes[(f"worker-{i}",)] = metrics.resident_memory(pid)
+    return {process: rss for process, rss in processes.items() if rss is not None}
+
+metrics.registry.register(metrics.Gauge(
+    "traffic_process_resident_memory_bytes", "Resident memory of the server and inference worker processes",
+    ["process"], collect=process_memory,
+))
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by the route template rather than the raw path so every signal shares one series
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        http_request_seconds.observe(time.perf_counter() - start, method=request.method, route=route)
+        signal_id = request.scope.get("path_params", {}).get("signal_id")
+        if signal_id is not None:
+            # Only registered signals get their own series, made up ids would grow the label set without bound
+            signal_id = signal_id if signal_id.isdigit() and int(signal_id) in signals else "unknown"
+            signal_requests.inc(signal_id=signal_id, route=route)
+            if status >= 400:
+                signal_errors.inc(signal_id=signal_id, route=route, status=status)
+
+# Admin-triggered cProfile captures of the next N requests and the inference jobs they submit
+request_profiler = RequestProfiler(PROFILES_DIR)
+
+@app.middleware("http")
+async def add_server_timing(request: Request, call_next):
+    """
+    Send the stage breakdown of instrumented endpoints as a Server-Timing header
+    """
+    timing = server_timing.begin()
+    response = await request_profiler.profile(request, call_next)
+    if timing.entries:
+        response.headers["Server-Timing"] = timing.header()
+    return response
+
+def require_admin(x_admin_token: str = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled, set ADMIN_TOKEN to enable them")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def start_profile(requests: int = 10):
+    """
+    Profile the next `requests` requests, the capture is served from /admin/profile/{capture_id}
+    """
+    if requests < 1:
+        raise HTTPException(status_code=400, detail="requests must be at least 1")
+    capture = await run_in_threadpool(request_profiler.arm, requests)
+    return {"capture_id": capture.capture_id, "requests": requests, "download_url": f"/admin/profile/{capture.capture_id}"}
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def get_profile_status():
+    return request_profiler.status()
+
+@app.get("/admin/profile/{capture_id}", dependencies=[Depends(require_admin)])
+async def get_profile(capture_id: str, format: str = "prof"):
+    """
+    Download the merged capture as a pstats file (snakeviz, pstats) or as a text report with format=text
+    """
+    if format == "text":
+        report = await run_in_threadpool(request_profiler.report, capture_id)
+        if report is None:
+            raise HTTPException(status_code=404, detail="Profile not found")
+        return PlainTextResponse(report)
+    path = await run_in_threadpool(request_profiler.merged, capture_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, filename=path.name, media_type="application/octet-stream")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/home", response_class=HTMLResponse)
 async def get_index(request: Request):
     # user = request.session.get('user')
@@ -97,82 +499,381 @@ async def get_index(request: Request):
 
 
 @app.get("/signals")
-async def get_signals():
-    return signals
+async def get_signals(
+    response: Response, intersection_id: int = None, name: str = None, ambulance: bool = None,
+    min_vehicles: int = None, offset: int = Query(0, ge=0),
+    limit: int = Query(SIGNALS_PAGE_SIZE, ge=1, le=SIGNALS_MAX_PAGE_SIZE)
+):
+    """
+    Signals by id, one page at a time, optionally filtered. X-Total-Count holds the number of matching signals.
+    """
+    total, page = await run_in_threadpool(
+        signals.query, intersection_id, name, ambulance, min_vehicles, offset, limit
+    )
+    response.headers["X-Total-Count"] = str(total)
+    return page
+
+@app.get("/signals/events")
+async def get_signal_events(intersection_id: List[int] = Query(None), signal_id: List[int] = Query(None)):
+    """
+    Server-sent events with the state of the matching signals, a snapshot event on connect and then an update event
+    holding only the changed fields whenever signals change. Filter with repeated intersection_id or signal_id.
+    """
+    return StreamingResponse(
+        signal_events.events(intersection_id, signal_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/signals/cycles")
+async def get_signal_cycles():
+    if signal_scheduler is None:
+        return {"running": False}
+    return {"running": True, **signal_scheduler.status()}
+
+@app.get("/intersections")
+async def get_intersections(
+    response: Response, offset: int = Query(0, ge=0), limit: int = Query(SIGNALS_PAGE_SIZE, ge=1, le=SIGNALS_MAX_PAGE_SIZE)
+):
+    total, page = await run_in_threadpool(signals.list_intersections, offset, limit)
+    response.headers["X-Total-Count"] = str(total)
+    return page
+
+@app.post("/intersections")
+async def create_intersection(intersection: IntersectionCreate):
+    """
+    Register an intersection with one signal per name
+    """
+    if not intersection.signals:
+        raise HTTPException(status_code=400, detail="An intersection needs at least one signal")
+    intersection_id, created = await run_in_threadpool(
+        signals.create_intersection, intersection.name, intersection.signals, NEW_SIGNAL
+    )
+    return {"intersection_id": intersection_id, "name": intersection.name, "signals": created}
 
 @app.post("/upload-image/{signal_id}")
-async def upload_image(signal_id: int,username: str = Form(...), file: UploadFile = File(...)):
+async def upload_image(
+    signal_id: int, background_tasks: BackgroundTasks, username: str = Form(...), file: UploadFile = File(...),
+    wait: bool = False
+):
+    if signal_id not in signals:
+        raise HTTPException(status_code=404, detail=f"Unknown signal {signal_id}")
+    check_username(username)
     logger.info(f"User {username} is uploading an image for signal {signal_id}")
-    os.system(f"mkdir -p uploads/{username}")
-    file_location = f"uploads/{username}/{file.filename}"
-    with open(file_location, "wb+") as file_object:
-        file_object.write(file.file.read())
-    
-    vehicle_count, detect_vehicle_file = num_vehicles(file_location)
-    ambulance_count,ambulance_detect_vehicle_file = ambulance_detection(file_location)
-    
-    signals[signal_id].update({
-        "vehicle_count": vehicle_count,
-        "ambulance_count": ambulance_count,
-        "image_path": ambulance_detect_vehicle_file if ambulance_count > 0 else detect_vehicle_file
-    })
-    
-    return {
-        "signal_id": signal_id,
-        "vehicle_count": vehicle_count,
-        "ambulance_count": ambulance_count,
-        "message": "Image uploaded and processed successfully",
-        "image_url": f"/get-image/{signal_id}?t={int(time.time())}"  # Add timestamp to force refresh
-    }
+    with server_timing.stage("read"):
+        contents = await file.read()
+    roi = signals.get(signal_id).get("roi")
+    with server_timing.stage("cache"):
+        cache_key = result_cache.key(contents, *detection_params, roi)
+        cached = result_cache.get(cache_key)
+
+    def apply_result(result):
+        vehicle_count, detect_vehicle_file, ambulance_count, ambulance_detect_vehicle_file, lane_counts = result
+        image_version = time.time_ns()
+        with server_timing.stage("state"):
+            signals.update(signal_id, {
+                "vehicle_count": vehicle_count,
+                "ambulance_count": ambulance_count,
+                "lane_counts": lane_counts,
+                "image_path": ambulance_detect_vehicle_file if ambulance_count > 0 else detect_vehicle_file,
+                "image_version": image_version
+            })
+        return {
+            "signal_id": signal_id,
+            "vehicle_count": vehicle_count,
+            "ambulance_count": ambulance_count,
+            "lane_counts": lane_counts,
+            "message": "Image uploaded and processed successfully",
+            "image_url": f"/get-image/{signal_id}?t={image_version}"  # Add version to force refresh
+        }
+
+    if cached is not None:
+        return {**apply_result(cached), "cached": True}
+
+    # The workers decode the bytes in memory, keeping the original on disk is off the critical path
+    if PERSIST_UPLOADS:
+        background_tasks.add_task(save_upload, upload_location(username, file.filename), contents)
+
+    # Coalesced with other signals' concurrent uploads into one batch, prefixed so their annotated images don't clash
+    job_id = submit_job(
+        "detect_uploads", (f"signal_{signal_id}_{file.filename}", contents, roi),
+        on_done=lambda result: apply_result(cache_result(cache_key, result)), batched=True
+    )
+    return await job_response(job_id, wait)
+
+@app.post("/upload-images")
+async def upload_images(
+    background_tasks: BackgroundTasks, username: str = Form(...), signal_ids: List[int] = Form(...),
+    files: List[UploadFile] = File(...), wait: bool = False
+):
+    """
+    Upload one image per signal and run them through the models as a single batch
+    """
+    if len(signal_ids) != len(files):
+        raise HTTPException(status_code=400, detail="Expected one signal_id per uploaded file")
+    unknown = [signal_id for signal_id in signal_ids if signal_id not in signals]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Unknown signals: {unknown}")
+    check_username(username)
+    logger.info(f"User {username} is uploading {len(files)} images for signals {signal_ids}")
+
+    contents = [await file.read() for file in files]
+    current = signals.get_many(signal_ids)
+    rois = [current[signal_id].get("roi") for signal_id in signal_ids]
+    cache_keys = [result_cache.key(c, *detection_params, roi) for c, roi in zip(contents, rois)]
+    cached = [result_cache.get(cache_key) for cache_key in cache_keys]
+    missing = [i for i, result in enumerate(cached) if result is None]
+
+    def apply_results(results):
+        # Apply every signal's result in one step so readers always see a consistent intersection
+        image_version = time.time_ns()
+        response = []
+        updates = {}
+        for signal_id, result in zip(signal_ids, results):
+            vehicle_count, detect_vehicle_file, ambulance_count, ambulance_detect_vehicle_file, lane_counts = result
+            updates[signal_id] = {
+                "vehicle_count": vehicle_count,
+                "ambulance_count": ambulance_count,
+                "lane_counts": lane_counts,
+                "image_path": ambulance_detect_vehicle_file if ambulance_count > 0 else detect_vehicle_file,
+                "image_version": image_version
+            }
+            response.append({
+                "signal_id": signal_id,
+                "vehicle_count": vehicle_count,
+                "ambulance_count": ambulance_count,
+                "lane_counts": lane_counts,
+                "image_url": f"/get-image/{signal_id}?t={image_version}"
+            })
+        signals.update_many(updates)
+        return {
+            "signals": response,
+            "message": "Images uploaded and processed successfully"
+        }
+
+    if not missing:
+        return {**apply_results(cached), "cached": True}
+
+    # Only the images that missed the cache go through the models
+    uploads = []
+    for i in missing:
+        # Prefix with the signal so cameras uploading the same filename don't overwrite each other
+        filename = f"signal_{signal_ids[i]}_{os.path.basename(files[i].filename)}"
+        uploads.append((filename, contents[i], rois[i]))
+        if PERSIST_UPLOADS:
+            background_tasks.add_task(save_upload, upload_location(username, filename), contents[i])
+
+    def merge_results(new_results):
+        for result in new_results:
+            if isinstance(result, Exception):  # an image that couldn't be decoded fails the whole upload
+                raise result
+        results = list(cached)
+        for i, result in zip(missing, new_results):
+            results[i] = cache_result(cache_keys[i], result)
+        return apply_results(results)
+
+    job_id = submit_job("detect_uploads", uploads, on_done=merge_results)
+    return await job_response(job_id, wait)
+
+async def stream_to_file(request, file_location, max_bytes):
+    """
+    Write the raw request body to file_location chunk by chunk as it arrives, never holding more than one chunk
+    """
+    os.makedirs(os.path.dirname(file_location), exist_ok=True)
+    received = 0
+    try:
+        with open(file_location, "wb") as file_object:
+            async for chunk in request.stream():
+                received += len(chunk)
+                if received > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds the {max_bytes} byte limit")
+                await run_in_threadpool(file_object.write, chunk)
+    except BaseException:
+        if os.path.exists(file_location):
+            os.remove(file_location)
+        raise
+    return received
+
+@app.post("/upload-video/{signal_id}")
+async def upload_video(signal_id: int, request: Request, username: str, filename: str, wait: bool = False):
+    """
+    Upload a traffic video as the raw request body and count vehicles over its frames
+    """
+    if signal_id not in signals:
+        raise HTTPException(status_code=404, detail=f"Unknown signal {signal_id}")
+    declared = int(request.headers.get("content-length") or 0)
+    if declared > VIDEO_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the {VIDEO_MAX_BYTES} byte limit")
+    check_username(username)
+    logger.info(f"User {username} is uploading a video for signal {signal_id}")
+
+    file_location = upload_location(username, f"signal_{signal_id}_{os.path.basename(filename)}")
+    size = await stream_to_file(request, file_location, VIDEO_MAX_BYTES)
+    logger.info(f"Received {size} bytes of video for signal {signal_id}")
+
+    def apply_video_result(result):
+        counts, stats, video_path = result
+        # Vehicles queued at the signal on an average frame
+        vehicle_count = round(sum(c["mean"] for c in stats["classes"].values()))
+        signals.update(signal_id, {"vehicle_count": vehicle_count})
+        return {
+            "signal_id": signal_id,
+            "vehicle_count": vehicle_count,
+            "vehicle_types": counts,
+            "stats": stats,
+            "message": "Video uploaded and processed successfully"
+        }
+
+    job_id = submit_job(
+        "count_video", file_location, on_done=apply_video_result, timeout=VIDEO_TIMEOUT, progress=True
+    )
+    return await job_response(job_id, wait)
+
+@app.post("/signals/{signal_id}/stream")
+async def register_stream(signal_id: int, stream: StreamConfig):
+    """
+    Ingest a camera stream (RTSP/HTTP URL or local video file) for the signal continuously
+    """
+    if signal_id not in signals:
+        raise HTTPException(status_code=404, detail=f"Unknown signal {signal_id}")
+    if not hasattr(app.state, "model_weights"):
+        raise HTTPException(status_code=503, detail="The models are still loading", headers={"Retry-After": "5"})
+    await run_in_threadpool(stream_ingestor.add, signal_id, stream.url)
+    signals.update(signal_id, {"stream_url": stream.url})
+    return {"signal_id": signal_id, "stream_url": stream.url, "message": "Stream registered"}
+
+@app.delete("/signals/{signal_id}/stream")
+async def remove_stream(signal_id: int):
+    if not stream_ingestor.remove(signal_id):
+        raise HTTPException(status_code=404, detail=f"No stream registered for signal {signal_id}")
+    signals.pop(signal_id, "stream_url")
+    return {"signal_id": signal_id, "message": "Stream removed"}
+
+@app.put("/signals/{signal_id}/roi")
+async def set_roi(signal_id: int, roi: SignalROI):
+    """
+    Only count vehicles inside the signal's lane polygons, reported per lane. Uploads are cropped to the lanes'
+    bounding rectangle and everything outside the lanes is masked before inference.
+    """
+    if signal_id not in signals:
+        raise HTTPException(status_code=404, detail=f"Unknown signal {signal_id}")
+    if not roi.lanes:
+        raise HTTPException(status_code=400, detail="A region of interest needs at least one lane")
+    names = [lane.name for lane in roi.lanes]
+    if len(set(names)) != len(names):
+        raise HTTPException(status_code=400, detail="Lane names must be unique")
+    for lane in roi.lanes:
+        if len(lane.points) < 3 or any(len(point) != 2 or not all(0 <= v <= 1 for v in point) for point in lane.points):
+            raise HTTPException(
+                status_code=400, detail=f"Lane {lane.name} needs at least three [x, y] points between 0 and 1"
+            )
+    value = roi.model_dump()
+    signals.update(signal_id, {"roi": value, "lane_counts": None})
+    return {"signal_id": signal_id, "roi": value, "message": "Region of interest set"}
+
+@app.delete("/signals/{signal_id}/roi")
+async def remove_roi(signal_id: int):
+    if signal_id not in signals or signals.get(signal_id).get("roi") is None:
+        raise HTTPException(status_code=404, detail=f"No region of interest set for signal {signal_id}")
+    signals.update(signal_id, {"roi": None, "lane_counts": None})
+    return {"signal_id": signal_id, "message": "Region of interest removed"}
+
+@app.get("/streams")
+async def get_streams():
+    return stream_ingestor.status()
+
+@app.get("/ready")
+async def get_ready():
+    """
+    Readiness probe, 503 until the inference workers have loaded the models
+    """
+    if app.state.ready:
+        return {"ready": True}
+    status = "failed" if app.state.warmup_error else "loading"
+    return JSONResponse(status_code=503, content={"ready": False, "status": status, "error": app.state.warmup_error})
+
+@app.get("/models")
+async def get_models():
+    return {"backend": MODEL_BACKEND, "weights": getattr(app.state, "model_weights", None), "benchmarks": model_reports}
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return result_cache.stats()
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = inference_pool.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 @app.get("/get-image/{signal_id}")
 async def get_image(signal_id: int):
-    if signal_id in signals and signals[signal_id]["image_path"]:
-        return FileResponse(signals[signal_id]["image_path"])
+    signal = signals.get(signal_id)
+    if signal and signal["image_path"] and os.path.exists(signal["image_path"]):
+        return FileResponse(signal["image_path"])
     return {"error": "Image not found"}
 
 
 @app.post("/update-timings")
 async def update_timings(update: SignalUpdate):
+    """
+    Re-time one intersection's signals from the submitted vehicle counts, within a fixed cycle of total_time seconds.
+    The cycle is kept on the signals, so the signal cycles carry on using it
+    """
     try:
         # Check for ambulances first
-        ambulance_signals = []
-        for timing in update.timings:
-            signal_id = timing.signal_id
-            if signal_id in signals:
-                if signals[signal_id]["ambulance_count"] > 0:
-                    ambulance_signals.append(signal_id)
-        
-        remaining_time = update.total_time
-        processed_signals = set()
-        
-        # Handle ambulance signals first
-        if ambulance_signals:
-            priority_time = max(45, update.total_time // len(ambulance_signals))
-            for signal_id in ambulance_signals:
-                signals[signal_id]["timing"] = priority_time
-                processed_signals.add(signal_id)
-                remaining_time -= priority_time
-        
-        # Allocate remaining time based on vehicle count
-        remaining_signals = [t for t in update.timings if t.signal_id not in processed_signals]
-        total_vehicle_count = sum(t.vehicle_count for t in remaining_signals)
-        
-        if total_vehicle_count > 0:
-            for timing in remaining_signals:
-                signal_id = timing.signal_id
-                vehicle_count = timing.vehicle_count
-                allocated_time = int(vehicle_count * remaining_time / total_vehicle_count)
-                signals[signal_id]["timing"] = allocated_time
-        
+        with server_timing.stage("ambulance-scan"):
+            current = signals.get_many([timing.signal_id for timing in update.timings])
+            requested = [timing for timing in update.timings if timing.signal_id in current]
+            ambulance = [current[timing.signal_id]["ambulance_count"] > 0 for timing in requested]
+
+        with server_timing.stage("allocation"):
+            counts, mask = signal_timing.pack([[timing.vehicle_count for timing in requested]])
+            _, greens = signal_timing.plan(counts, [ambulance], mask, cycle=update.total_time)
+            timings = {
+                timing.signal_id: {"timing": int(green), "cycle": update.total_time}
+                for timing, green in zip(requested, greens[0])
+            }
+
+        with server_timing.stage("state"):
+            signals.update_many(timings)
+
         return {
             "message": "Timings updated successfully",
-            "ambulance_priority": len(ambulance_signals) > 0
+            "ambulance_priority": any(ambulance)
         }
     except Exception as e:
         logger.error(f"Error updating timings: {e}")
         raise HTTPException(status_code=500, detail="An error occurred while updating timings")
 
+@app.post("/intersections/timings")
+async def retime_intersections(plan: TimingPlan):
+    """
+    Re-time many intersections at once from the vehicle counts and ambulances currently recorded for their signals.
+    The cycle is kept on the signals for the signal cycles, omitting it hands the intersections back to Webster's cycle
+    """
+    with server_timing.stage("read"):
+        intersections = await run_in_threadpool(signals.by_intersection, plan.intersection_ids)
+        intersections = {i: states for i, states in intersections.items() if states}
+        groups = [list(states.values()) for states in intersections.values()]
+
+    with server_timing.stage("allocation"):
+        counts, mask = signal_timing.pack([[state["vehicle_count"] for state in group] for group in groups])
+        ambulance, _ = signal_timing.pack([[state["ambulance_count"] > 0 for state in group] for group in groups])
+        cycles, greens = signal_timing.plan(counts, ambulance.astype(bool), mask, cycle=plan.cycle)
+
+    with server_timing.stage("state"):
+        timings = {}
+        result = {}
+        for row, (intersection_id, states) in enumerate(intersections.items()):
+            planned = {signal_id: int(green) for signal_id, green in zip(states, greens[row])}
+            timings.update({signal_id: {"timing": green, "cycle": plan.cycle} for signal_id, green in planned.items()})
+            result[intersection_id] = {"cycle": int(cycles[row]), "timings": planned}
+        await run_in_threadpool(signals.update_many, timings)
+
+    return {"intersections": result}
+
 def clone_and_setup_yolov5():
     try:
         # Clone the repository
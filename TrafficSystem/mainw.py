@@ -13,6 +13,7 @@ import uvicorn
 import os,subprocess
 import time
 import platform
+import sys
 
 import logging
 from fastapi.staticfiles import StaticFiles
@@ -161,22 +162,27 @@ def clone_and_setup_yolov5():
         os.chdir("..")
 
 if __name__ == "__main__":
-    os.chdir("..")
-    
-    # Remove existing yolov5 directory
-    if platform.system() == "Windows":
-        os.system("rmdir /S /Q yolov5")
-    else:
-        os.system("rm -rf yolov5")
-    
-    clone_and_setup_yolov5()
-    
-    # Copy detect.py file from TrafficSystem to yolov5
-    if platform.system() == "Windows":
-        os.system("copy TrafficSystem\\detect.py yolov5")
-    else:
-        os.system("cp TrafficSystem/detect.py yolov5")
-    
+    # YOLOv5 is vendored at build time (see the Dockerfile), cloning and installing it on every start made cold
+    # starts take minutes. Pass --setup to fetch it once on a development machine.
+    if "--setup" in sys.argv:
+        os.chdir("..")
+
+        # Remove existing yolov5 directory
+        if platform.system() == "Windows":
+            os.system("rmdir /S /Q yolov5")
+        else:
+            os.system("rm -rf yolov5")
+
+        clone_and_setup_yolov5()
+
+        # Copy detect.py file from TrafficSystem to yolov5
+        if platform.system() == "Windows":
+            os.system("copy TrafficSystem\\detect.py yolov5")
+        else:
+            os.system("cp TrafficSystem/detect.py yolov5")
+
+        os.chdir("TrafficSystem")
+
     #know the current directory
     print("Current Directory",os.getcwd())
     
@@ -187,7 +193,5 @@ if __name__ == "__main__":
     
     # app.mount("/TrafficMonitor", StaticFiles(directory=traffic_monitor_dir), name="TrafficMonitor")
     
-    os.chdir("TrafficSystem")
-    
     # Start the FastAPI app
     uvicorn.run("mainw:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,187 @@
+import bisect
+import os
+import platform
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from a cached upload up to a long video
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+def format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Metric:
+    """
+    A named metric family in the Prometheus text format, one series per combination of label values
+    """
+
+    type = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            for values, value in sorted(self.series.items()):
+                lines.extend(self.samples(values, value))
+        return lines
+
+    def samples(self, values, value):
+        return [f"{self.name}{format_labels(self.labelnames, values)} {value}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that is set directly, or read from collect() at every scrape, which returns {label values: value}
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.series[self.key(labels)] = value
+
+    def render(self):
+        if self.collect is not None:
+            collected = self.collect()
+            with self.lock:
+                self.series = {tuple(str(v) for v in k): value for k, value in collected.items()}
+        return super().render()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(self.buckets), 0, 0.0]  # bucket counts, count, sum
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                series[0][i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def samples(self, values, value):
+        counts, count, total = value
+        lines, cumulative = [], 0
+        for bound, bucket in zip(self.buckets, counts):
+            cumulative += bucket
+            lines.append(f"{self.name}_bucket{format_labels(self.labelnames, values, [('le', bound)])} {cumulative}")
+        lines.append(f"{self.name}_bucket{format_labels(self.labelnames, values, [('le', '+Inf')])} {count}")
+        lines.append(f"{self.name}_count{format_labels(self.labelnames, values)} {count}")
+        lines.append(f"{self.name}_sum{format_labels(self.labelnames, values)} {total}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.register(Histogram(
+    "traffic_detection_stage_seconds", "Time spent in each detection pipeline stage", ["stage", "model"]
+))
+
+# Worker processes can't be scraped, they buffer their stage timings and hand them back with each job result
+_buffer = None
+
+
+def buffer_observations():
+    """
+    Buffer stage timings in this process instead of observing them, for an inference worker
+    """
+    global _buffer
+    _buffer = []
+
+
+def drain():
+    """
+    Return and clear the buffered (stage, model, seconds) observations
+    """
+    global _buffer
+    if _buffer is None:
+        return []
+    observations, _buffer = _buffer, []
+    return observations
+
+
+def merge(observations):
+    for stage, model, seconds in observations:
+        stage_seconds.observe(seconds, stage=stage, model=model)
+
+
+@contextmanager
+def timed(stage, model=""):
+    """
+    Time the enclosed block as one observation of stage for model
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if _buffer is not None:
+            _buffer.append((stage, model, seconds))
+        else:
+            stage_seconds.observe(seconds, stage=stage, model=model)
+
+
+def resident_memory(pid="self"):
+    """
+    Resident set size of a process in bytes, or None if it can't be read
+    """
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        if pid != "self" or platform.system() == "Windows":
+            return None
+        import resource
+
+        # Without procfs only the peak is available, in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if platform.system() == "Darwin" else peak * 1024
@@ -0,0 +1,180 @@
+import json
+import logging
+import multiprocessing
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# CPU backends DetectMultiBackend can load, in the order they are benchmarked. "pt" is the accuracy reference.
+BACKENDS = ("pt", "onnx", "onnx-int8", "openvino")
+# Backends whose counts can drift from the reference, only selected when their accuracy was measured
+QUANTISED_BACKENDS = ("onnx-int8",)
+
+
+def export_path(weights, backend):
+    """
+    Where the export of weights for backend is cached, next to the weights file
+    """
+    weights = Path(weights)
+    if backend == "pt":
+        return weights
+    if backend == "onnx":
+        return weights.with_suffix(".onnx")
+    if backend == "onnx-int8":
+        return weights.with_name(f"{weights.stem}-int8.onnx")
+    if backend == "openvino":
+        return weights.with_name(f"{weights.stem}_openvino_model")
+    raise ValueError(f"Unknown model backend {backend}")
+
+
+def export(weights, backend, imgsz):
+    """
+    Export weights for backend unless an export at least as new as the weights is already cached
+    """
+    path = export_path(weights, backend)
+    if path.exists() and path.stat().st_mtime >= Path(weights).stat().st_mtime:
+        return path
+
+    logger.info(f"Exporting {weights} for {backend}")
+    if backend in ("onnx", "openvino"):
+        import yolo_module  # noqa: F401, puts the YOLOv5 checkout on sys.path
+        import export as yolov5_export  # export.py of the YOLOv5 checkout
+
+        # Dynamic axes let the ONNX model take the stacked batches of detect_shared
+        yolov5_export.run(weights=weights, imgsz=(imgsz, imgsz), include=(backend,), device="cpu", dynamic=backend == "onnx")
+    elif backend == "onnx-int8":
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(str(export(weights, "onnx", imgsz)), str(path), weight_type=QuantType.QUInt8)
+    return path
+
+
+def calibration_images(calibration_dir, imgsz, count=4):
+    """
+    Images to benchmark on. Without a calibration directory a fixed random image is used, which is
+    enough for latency but gives no meaningful accuracy comparison.
+    """
+    import cv2
+    import numpy as np
+
+    if calibration_dir:
+        import yolo_module  # noqa: F401, puts the YOLOv5 checkout on sys.path
+        from utils.dataloaders import IMG_FORMATS
+
+        files = sorted(p for p in Path(calibration_dir).iterdir() if p.suffix[1:].lower() in IMG_FORMATS)
+        images = [cv2.imread(str(p)) for p in files[:count]]
+        images = [im for im in images if im is not None]
+        if images:
+            return images, True
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 255, (imgsz, imgsz, 3), dtype=np.uint8)], False
+
+
+def benchmark(weights, backends, imgsz, conf_thres, calibration_dir=None, runs=10):
+    """
+    Time every backend on the calibration images and compare its per-image counts with the PyTorch model, which is
+    always benchmarked first as the reference. Backends that cannot be exported or loaded are reported with their
+    error instead.
+    """
+    import numpy as np
+    from yolo_module import Detector, detect_shared
+
+    images, calibrated = calibration_images(calibration_dir, imgsz)
+    reference = None
+    report = {}
+    for backend in ["pt", *(backend for backend in backends if backend != "pt")]:
+        try:
+            path = export(weights, backend, imgsz)
+            detector = Detector(str(path), imgsz=(imgsz, imgsz), device="cpu")
+            detect_shared([detector], images, conf_thres=conf_thres)  # warmup
+            times = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                (results,) = detect_shared([detector], images, conf_thres=conf_thres)
+                times.append(time.perf_counter() - start)
+        except Exception as e:
+            logger.warning(f"Backend {backend} unavailable for {weights}: {e}")
+            report[backend] = {"error": str(e)}
+            continue
+
+        counts = [len(r) for r in results]
+        if backend == "pt":
+            reference = counts
+        report[backend] = {
+            "path": str(path),
+            "latency_ms": statistics.median(times) * 1000 / len(images),
+            "count_delta": (
+                float(np.mean(np.abs(np.subtract(counts, reference)))) if calibrated and reference is not None else None
+            ),
+        }
+    if reference is not None:
+        for result in report.values():
+            if "latency_ms" in result:
+                result["latency_delta_ms"] = result["latency_ms"] - report["pt"]["latency_ms"]
+    return report
+
+
+def select_backend(weights, backends, imgsz, conf_thres, calibration_dir=None, max_count_delta=0.5, runs=10):
+    """
+    Pick the fastest backend whose counts stay within max_count_delta of the PyTorch model. Quantised backends are
+    left out when their accuracy couldn't be measured, without calibration images or a working PyTorch reference.
+    The benchmark report is cached next to the weights and reused until the weights change.
+    Returns (weights path to load, report)
+    """
+    weights = Path(weights)
+    report_path = weights.with_name(f"{weights.stem}.backends.json")
+    key = {"weights_mtime": weights.stat().st_mtime, "backends": list(backends), "imgsz": imgsz,
+           "calibration_dir": str(calibration_dir or "")}
+    report = None
+    if report_path.exists():
+        cached = json.loads(report_path.read_text())
+        if cached.get("key") == key:
+            report = cached["report"]
+    if report is None:
+        report = benchmark(weights, backends, imgsz, conf_thres, calibration_dir, runs)
+        report_path.write_text(json.dumps({"key": key, "report": report}, indent=2))
+
+    def accurate(backend, result):
+        if result["count_delta"] is None:
+            return backend not in QUANTISED_BACKENDS
+        return result["count_delta"] <= max_count_delta
+
+    candidates = [
+        (result["latency_ms"], backend)
+        for backend, result in report.items()
+        if backend in backends and "latency_ms" in result and accurate(backend, result)
+    ]
+    if not candidates:
+        return str(weights), report
+    _, backend = min(candidates)
+    logger.info(f"Selected {backend} backend for {weights.name}: {report[backend]}")
+    return str(export(weights, backend, imgsz)), report  # re-exports if the cached export was removed
+
+
+def resolve(weights_files, backend, candidates, imgsz, conf_thres, calibration_dir=None, max_count_delta=0.5, runs=10):
+    """
+    Model file to serve for each weights file, its export for backend, or with backend "auto" the one select_backend
+    picks. Returns (paths, {weights file name: benchmark report})
+    """
+    paths, reports = [], {}
+    for weights in weights_files:
+        if backend == "auto":
+            path, reports[Path(weights).name] = select_backend(
+                weights, candidates, imgsz, conf_thres, calibration_dir, max_count_delta, runs
+            )
+        else:
+            path = str(export(weights, backend, imgsz))
+        paths.append(path)
+    return paths, reports
+
+
+def resolve_in_subprocess(*args, **kwargs):
+    """
+    resolve in a short-lived process, exporting and benchmarking import torch and load every backend's model, and
+    none of that should stay behind in the server
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(resolve, *args, **kwargs).result()
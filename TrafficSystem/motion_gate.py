@@ -0,0 +1,49 @@
+class MotionGate:
+    """
+    Cheap scene-change check run before inference. Each frame is shrunk to a small grayscale
+    thumbnail and compared with the thumbnail of the last frame that was actually inferred for
+    the same source; when the mean absolute difference stays under the threshold the caller can
+    reuse the previous detections. Every max_skip-th frame is inferred regardless, so slow
+    changes are never missed for long.
+    """
+
+    def __init__(self, threshold=2.0, size=(64, 36), max_skip=30):
+        self.threshold = threshold
+        self.size = size
+        self.max_skip = max_skip
+        self.reference = {}
+        self.skip_runs = {}
+        self.frames = 0
+        self.skipped = 0
+
+    def changed(self, im0, key=0):
+        """
+        True if the frame must be inferred, False if the last detections for key still apply
+        """
+        import cv2
+
+        thumbnail = cv2.resize(cv2.cvtColor(im0, cv2.COLOR_BGR2GRAY), self.size, interpolation=cv2.INTER_AREA)
+        self.frames += 1
+        reference = self.reference.get(key)
+        if (
+            reference is not None
+            and self.skip_runs[key] < self.max_skip
+            and cv2.absdiff(thumbnail, reference).mean() < self.threshold
+        ):
+            self.skip_runs[key] += 1
+            self.skipped += 1
+            return False
+        self.reference[key] = thumbnail
+        self.skip_runs[key] = 0
+        return True
+
+    def forget(self, key):
+        self.reference.pop(key, None)
+        self.skip_runs.pop(key, None)
+
+    @property
+    def skip_ratio(self):
+        return self.skipped / self.frames if self.frames else 0.0
+
+    def stats(self):
+        return {"frames": self.frames, "skipped": self.skipped, "skip_ratio": self.skip_ratio}
@@ -0,0 +1,117 @@
+import contextvars
+import cProfile
+import io
+import logging
+import pstats
+import threading
+import time
+import uuid
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Capture the request being handled belongs to, so the jobs it submits are profiled in the worker too
+_current = contextvars.ContextVar("profile_capture", default=None)
+
+
+class Capture:
+    def __init__(self, directory, requests):
+        self.capture_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.directory = Path(directory) / self.capture_id
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.requested = requests
+        self.remaining = requests
+        self.files = 0
+
+    def next_path(self, process):
+        self.files += 1
+        return str(self.directory / f"{self.files:04d}-{process}.prof")
+
+
+class RequestProfiler:
+    """
+    Profiles the next N requests with cProfile, in the server process and in the inference workers running
+    their jobs. Every request and job writes its own stats file, which are merged into one profile on download.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.lock = threading.Lock()
+        self.capture = None
+        self.active = False
+
+    def arm(self, requests):
+        with self.lock:
+            self.capture = Capture(self.directory, requests)
+        logger.info(f"Profiling the next {requests} requests as {self.capture.capture_id}")
+        return self.capture
+
+    def take(self):
+        """
+        Claim one profiled request, None if no capture is armed or another request is being profiled,
+        since only one cProfile profiler can be active per thread
+        """
+        with self.lock:
+            if self.capture is None or self.capture.remaining <= 0 or self.active:
+                return None
+            self.capture.remaining -= 1
+            self.active = True
+            return self.capture
+
+    async def profile(self, request, call_next):
+        capture = self.take()
+        if capture is None:
+            return await call_next(request)
+        token = _current.set(capture)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return await call_next(request)
+        finally:
+            profiler.disable()
+            _current.reset(token)
+            profiler.dump_stats(capture.next_path("server"))
+            with self.lock:
+                self.active = False
+
+    def job_profile_path(self):
+        """
+        Stats file for an inference job submitted by the current request, None if it is not being profiled
+        """
+        capture = _current.get()
+        return capture.next_path("worker") if capture is not None else None
+
+    def status(self):
+        captures = sorted(p.name for p in self.directory.iterdir() if p.is_dir()) if self.directory.exists() else []
+        current = self.capture
+        return {
+            "current": {
+                "capture_id": current.capture_id,
+                "requested": current.requested,
+                "remaining": current.remaining,
+            } if current is not None else None,
+            "captures": captures,
+        }
+
+    def merged(self, capture_id):
+        """
+        Merge the stats files of a capture into one profile, returns its path or None if there is nothing to merge
+        """
+        directory = self.directory / Path(capture_id).name
+        files = sorted(str(p) for p in directory.glob("*.prof")) if directory.is_dir() else []
+        if not files:
+            return None
+        path = self.directory / f"{directory.name}.prof"
+        pstats.Stats(*files).dump_stats(path)
+        return path
+
+    def report(self, capture_id, sort="cumulative", limit=50):
+        """
+        Text report of the merged profile, the functions with the highest cumulative time first
+        """
+        path = self.merged(capture_id)
+        if path is None:
+            return None
+        out = io.StringIO()
+        pstats.Stats(str(path), stream=out).sort_stats(sort).print_stats(limit)
+        return out.getvalue()
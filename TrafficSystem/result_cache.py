@@ -0,0 +1,74 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    LRU cache of detection results keyed by the image content and the detection parameters.
+    Bounded by entry count (memory) and by the total size of the annotated images it keeps alive (disk).
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=256 * 1024**2):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(contents, *params):
+        digest = hashlib.sha256(contents)
+        digest.update(repr(params).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        # An annotated image removed from disk makes the entry useless for serving
+        if entry is not None and not all(os.path.exists(p) for p in entry["paths"]):
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry["value"]
+
+    def put(self, key, value, paths=()):
+        if key in self.entries:
+            self._remove(key)
+        paths = [p for p in paths if p]
+        size = sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+        self.entries[key] = {"value": value, "paths": paths, "size": size}
+        self.bytes += size
+        while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def prune(self):
+        """
+        Drop the entries whose annotated images were removed, e.g. by the retention collector
+        """
+        missing = [key for key, entry in self.entries.items() if not all(os.path.exists(p) for p in entry["paths"])]
+        for key in missing:
+            self._remove(key)
+        self.evictions += len(missing)
+        return len(missing)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.bytes -= entry["size"]
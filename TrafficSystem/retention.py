@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionPolicy:
+    """
+    Age, count and size limits for the entries directly inside a directory, 0 disables a limit
+    """
+
+    def __init__(self, max_age=0, max_count=0, max_bytes=0):
+        self.max_age = max_age
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+
+
+def entry_size(path):
+    if not path.is_dir():
+        return path.stat().st_size
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def remove_entry(path):
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def enforce(directory, policy, keep=()):
+    """
+    Evict the oldest entries of directory until it satisfies policy.
+    Entries containing any path in keep are never removed. Returns the number of entries removed.
+    """
+    directory = Path(directory)
+    if not directory.is_dir():
+        return 0
+    keep = [Path(p).resolve() for p in keep]
+
+    entries = []
+    for path in directory.iterdir():
+        try:
+            entries.append((path.stat().st_mtime, entry_size(path), path))
+        except FileNotFoundError:
+            continue  # removed while scanning
+    entries.sort()  # oldest first
+
+    now = time.time()
+    count = len(entries)
+    total_bytes = sum(size for _, size, _ in entries)
+    removed = 0
+    for mtime, size, path in entries:
+        expired = policy.max_age and now - mtime > policy.max_age
+        too_many = policy.max_count and count > policy.max_count
+        too_big = policy.max_bytes and total_bytes > policy.max_bytes
+        if not (expired or too_many or too_big):
+            break
+        resolved = path.resolve()
+        if any(resolved == p or resolved in p.parents for p in keep):
+            continue
+        remove_entry(path)
+        count -= 1
+        total_bytes -= size
+        removed += 1
+    return removed
+
+
+class RetentionCollector:
+    """
+    Background collector that keeps detection runs and per-user uploads within their retention limits
+    """
+
+    def __init__(
+        self, runs_dir, runs_policy, uploads_dir, uploads_policy, interval=300, keep=lambda: (), on_removed=None
+    ):
+        self.runs_dir = Path(runs_dir)
+        self.runs_policy = runs_policy
+        self.uploads_dir = Path(uploads_dir)
+        self.uploads_policy = uploads_policy
+        self.interval = interval
+        # Callable returning paths still in use, e.g. the images the dashboard is showing
+        self.keep = keep
+        # Called on the event loop after a pass that removed entries, to forget state that pointed into them
+        self.on_removed = on_removed
+
+    def collect(self, keep=()):
+        removed = enforce(self.runs_dir, self.runs_policy, keep)
+        if self.uploads_dir.is_dir():
+            for user_dir in self.uploads_dir.iterdir():
+                if user_dir.is_dir():
+                    removed += enforce(user_dir, self.uploads_policy, keep)
+        if removed:
+            logger.info(f"Retention collector removed {removed} old runs and uploads")
+        return removed
+
+    async def run(self):
+        while True:
+            try:
+                # Read the in-use paths on the event loop, the filesystem work runs in a thread
+                keep = [p for p in self.keep() if p]
+                removed = await asyncio.to_thread(self.collect, keep)
+                if removed and self.on_removed is not None:
+                    self.on_removed()
+            except Exception as e:
+                logger.error(f"Retention collection failed: {e}")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,122 @@
+"""
+Pre-fork production server. The detection models are loaded once in this parent process, then the uvicorn workers are
+forked from it and share the weight pages copy-on-write, as do the inference processes each worker forks in turn.
+Signal state and job statuses live in a multiprocessing manager so every worker sees the same signals.
+
+Usage:
+    $ cd TrafficSystem
+    $ python serve.py --workers 4 --port 8000
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+from multiprocessing.connection import wait
+
+logger = logging.getLogger("serve")
+
+
+def listen(host, port, backlog=2048):
+    """
+    Bind the listening socket once in the parent, every forked worker accepts on it
+    """
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def serve_worker(index, app, sock, opt):
+    import uvicorn
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    logger.info(f"Worker {index} serving as process {os.getpid()}")
+    app.state.signal_cycles = index == 0 and app.state.signal_cycles  # one process cycles the shared signals
+    config = uvicorn.Config(app, host=opt.host, port=opt.port, log_level=opt.log_level)
+    uvicorn.Server(config).run(sockets=[sock])  # installs its own signal handlers for a graceful shutdown
+
+
+def fork_worker(index, app, sock, opt):
+    # A multiprocessing fork, unlike a bare os.fork, reconnects the manager proxies in the child
+    process = multiprocessing.get_context("fork").Process(
+        target=serve_worker, args=(index, app, sock, opt), name=f"worker-{index}"
+    )
+    process.start()
+    return process
+
+
+def parse_opt():
+    """Parses command-line arguments for the pre-fork server."""
+    from config import WEB_WORKERS
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS, help="server processes to fork")
+    parser.add_argument("--log-level", type=str, default="info")
+    return parser.parse_args()
+
+
+def main(opt):
+    """Loads the models, forks the workers and restarts any that exit until told to stop."""
+    logging.basicConfig(level=opt.log_level.upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    # The manager is started before the models are loaded so its process doesn't carry a copy of them
+    manager = multiprocessing.get_context("spawn").Manager()
+
+    import torch
+
+    import main as server
+    from config import DEVICE, INFERENCE_WORKERS, SIGNAL_CYCLES
+    from yolo_module import configure_weights, load_detectors
+
+    if DEVICE != "cpu" and torch.cuda.is_available():
+        raise SystemExit("CUDA can't be shared across fork, set DEVICE=cpu or run main.py for GPU serving")
+
+    server.share_state(manager)
+    server.app.state.signal_cycles = SIGNAL_CYCLES
+    server.app.state.model_weights = server.prepare_models()
+    configure_weights(*server.app.state.model_weights)
+    load_detectors()
+    # Every worker forks its inference processes from itself so they inherit the loaded models
+    server.inference_pool.start_method = "fork"
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // (opt.workers * INFERENCE_WORKERS)))
+
+    sock = listen(opt.host, opt.port)
+    workers = [fork_worker(i, server.app, sock, opt) for i in range(opt.workers)]
+    logger.info(f"Forked {opt.workers} workers listening on {opt.host}:{opt.port}")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in workers:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while not stopping:
+        wait([process.sentinel for process in workers], timeout=1.0)
+        for index, process in enumerate(workers):
+            if process.exitcode is not None and not stopping:
+                logger.warning(f"Worker {index} exited with code {process.exitcode}, restarting it")
+                workers[index] = fork_worker(index, server.app, sock, opt)
+    for process in workers:
+        process.join()
+
+    sock.close()
+    manager.shutdown()
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
@@ -0,0 +1,55 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+# Timing of the request being handled, set by the middleware and inherited by the tasks the request starts
+_current = contextvars.ContextVar("server_timing", default=None)
+
+
+class ServerTiming:
+    """
+    Stage durations of one request, rendered as a Server-Timing header
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.entries = {}
+
+    def add(self, name, seconds):
+        self.entries[name] = self.entries.get(name, 0.0) + seconds
+
+    def header(self):
+        entries = [*self.entries.items(), ("total", time.perf_counter() - self.start)]
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in entries)
+
+
+def begin():
+    timing = ServerTiming()
+    _current.set(timing)
+    return timing
+
+
+def add(name, seconds):
+    timing = _current.get()
+    if timing is not None:
+        timing.add(name, seconds)
+
+
+def add_stages(stages):
+    """
+    Add the {name: seconds} stage timings of an inference job
+    """
+    for name, seconds in stages.items():
+        add(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    """
+    Time the enclosed block as a stage of the current request, does nothing outside a request
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name, time.perf_counter() - start)
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    One connected client, receiving the signals that match its filters. A client that falls too far behind is
+    sent a fresh snapshot instead of the updates it missed.
+    """
+
+    def __init__(self, intersection_ids=None, signal_ids=None, queue_size=256):
+        self.intersection_ids = set(intersection_ids) if intersection_ids else None
+        self.signal_ids = set(signal_ids) if signal_ids else None
+        self.queue = asyncio.Queue(queue_size)
+        self.lagging = False
+
+    def matches(self, signal_id, state):
+        return (self.signal_ids is None or signal_id in self.signal_ids) and (
+            self.intersection_ids is None or state.get("intersection_id") in self.intersection_ids
+        )
+
+
+class SignalEventBroker:
+    """
+    Pushes signal state changes to the connected dashboards as server-sent events.
+
+    The broker keeps the last state it published for every signal and sends each subscriber only the fields that
+    changed since, so the cost of an update depends on how much changed rather than on how many clients poll.
+    Changes made in this process wake the broker straight away, changes made by other pre-forked workers are picked
+    up on the next check of the shared store every interval seconds.
+    """
+
+    def __init__(self, store, interval=0.25, queue_size=256, heartbeat=15.0):
+        self.store = store
+        self.interval = interval
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self.subscriptions = set()
+        self.states = {}
+        self.sequence = 0
+        self.loop = None
+        self.wakeup = None
+
+    def start(self, loop):
+        self.loop = loop
+        self.wakeup = asyncio.Event()
+        # Read the sequence first, a change made in between is published again as an empty or repeated diff
+        self.sequence = self.store.sequence.value
+        self.states = self.store.all()
+        self.store.listeners.append(self.notify)
+
+    def stop(self):
+        if self.notify in self.store.listeners:
+            self.store.listeners.remove(self.notify)
+
+    def notify(self):
+        """
+        Wake the broker, safe to call from any thread
+        """
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def run(self):
+        """
+        Publish changes until cancelled
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                sequence, changed = await asyncio.to_thread(self.store.changes_since, self.sequence)
+            except Exception as e:
+                logger.error(f"Reading signal changes failed: {e}")
+                continue
+            if changed:
+                self.publish(sequence, changed)
+            self.sequence = sequence
+
+    def publish(self, sequence, changed):
+        """
+        Diff the changed signals against the last published state and queue the differences for every subscriber
+        """
+        changes = {}
+        for signal_id, state in changed.items():
+            previous = self.states.get(signal_id, {})
+            fields = {key: value for key, value in state.items() if previous.get(key) != value or key not in previous}
+            fields.update(dict.fromkeys(previous.keys() - state.keys()))  # removed fields are sent as null
+            self.states[signal_id] = state
+            if fields:
+                changes[signal_id] = fields
+        if not changes:
+            return
+        for subscription in self.subscriptions:
+            if subscription.lagging:
+                continue
+            matched = {
+                signal_id: fields for signal_id, fields in changes.items()
+                if subscription.matches(signal_id, self.states[signal_id])
+            }
+            if not matched:
+                continue
+            try:
+                subscription.queue.put_nowait(("update", sequence, matched))
+            except asyncio.QueueFull:
+                subscription.lagging = True
+
+    def snapshot(self, subscription):
+        """
+        Full state of the signals the subscription matches, as last published
+        """
+        return {
+            signal_id: dict(state)
+            for signal_id, state in sorted(self.states.items())
+            if subscription.matches(signal_id, state)
+        }
+
+    async def events(self, intersection_ids=None, signal_ids=None):
+        """
+        Server-sent event stream for one client, a snapshot first and then the changed fields of matching signals
+        """
+        subscription = Subscription(intersection_ids, signal_ids, self.queue_size)
+        self.subscriptions.add(subscription)
+        try:
+            yield self.format("snapshot", self.sequence, self.snapshot(subscription))
+            while True:
+                if subscription.lagging:
+                    while not subscription.queue.empty():
+                        subscription.queue.get_nowait()
+                    subscription.lagging = False
+                    yield self.format("snapshot", self.sequence, self.snapshot(subscription))
+                try:
+                    event, sequence, signals = await asyncio.wait_for(subscription.queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"  # stops proxies from closing an idle connection
+                    continue
+                yield self.format(event, sequence, signals)
+        finally:
+            self.subscriptions.discard(subscription)
+
+    @staticmethod
+    def format(event, sequence, signals):
+        data = json.dumps({"version": sequence, "signals": signals}, default=str)
+        return f"event: {event}\nid: {sequence}\ndata: {data}\n\n"
+
+    def stats(self):
+        return {"subscribers": len(self.subscriptions), "signals": len(self.states), "version": self.sequence}
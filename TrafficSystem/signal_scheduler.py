@@ -0,0 +1,142 @@
+import asyncio
+import heapq
+import logging
+import math
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+phase_lag_seconds = metrics.registry.register(metrics.Histogram(
+    "traffic_signal_phase_lag_seconds", "How late signal phase changes run after their scheduled time",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+))
+
+
+class Cycle:
+    """
+    Position of one intersection in its signal cycle, the signals turn green one after the other in id order
+    """
+
+    __slots__ = ("signal_ids", "index", "phase", "generation")
+
+    def __init__(self, signal_ids, generation):
+        self.signal_ids = list(signal_ids)
+        self.index = -1  # no signal has been green yet
+        self.phase = "Yellow"  # so the first boundary starts the first green
+        self.generation = generation
+
+
+class SignalScheduler:
+    """
+    Runs the red/yellow/green cycle of every registered intersection in one asyncio task.
+
+    Phase boundaries of all intersections sit in a single heap of (deadline, intersection_id, generation). The task
+    sleeps until the earliest deadline and handles every boundary that is due in one batch. Intersections starting a
+    green are re-planned together with one WebsterTiming call from the latest counts in the store, within the cycle
+    set for the intersection through /update-timings or /intersections/timings if there is one, and all the status
+    changes are written with one update_many, from where the signal event broker pushes them to the dashboards.
+    Deadlines follow from the previous deadline rather than the wake-up time, so lateness doesn't accumulate.
+    """
+
+    def __init__(self, store, timing, yellow=3.0, resync_interval=5.0):
+        self.store = store
+        self.timing = timing
+        self.yellow = yellow
+        self.resync_interval = resync_interval
+        self.cycles = {}
+        self.heap = []
+        self.generation = 0
+
+    async def run(self):
+        """
+        Cycle the signals until cancelled
+        """
+        loop = asyncio.get_running_loop()
+        next_sync = loop.time()
+        while True:
+            now = loop.time()
+            if now >= next_sync:
+                try:
+                    await self.sync(now)
+                except Exception as e:
+                    logger.error(f"Reading the intersections failed: {e}")
+                next_sync = now + self.resync_interval
+            due = []
+            while self.heap and self.heap[0][0] <= now:
+                deadline, intersection_id, generation = heapq.heappop(self.heap)
+                cycle = self.cycles.get(intersection_id)
+                if cycle is not None and cycle.generation == generation:  # skip entries of replaced cycles
+                    due.append((deadline, intersection_id, cycle))
+            if due:
+                try:
+                    await self.advance(due, now)
+                except Exception as e:
+                    logger.error(f"Advancing {len(due)} signal cycles failed: {e}")
+                    for _, intersection_id, cycle in due:  # retried on the next pass
+                        heapq.heappush(self.heap, (now + 1.0, intersection_id, cycle.generation))
+            wake = min(self.heap[0][0] if self.heap else math.inf, next_sync)
+            await asyncio.sleep(max(wake - loop.time(), 0))
+
+    async def sync(self, now):
+        """
+        Start cycling intersections registered since the last sync, by any process
+        """
+        intersections = await asyncio.to_thread(self.store.intersections.copy)
+        for intersection_id, intersection in intersections.items():
+            cycle = self.cycles.get(intersection_id)
+            if intersection["signal_ids"] and (cycle is None or cycle.signal_ids != intersection["signal_ids"]):
+                self.generation += 1
+                self.cycles[intersection_id] = Cycle(intersection["signal_ids"], self.generation)
+                heapq.heappush(self.heap, (now, intersection_id, self.generation))
+        for intersection_id in self.cycles.keys() - intersections.keys():
+            del self.cycles[intersection_id]
+
+    async def advance(self, due, now):
+        """
+        Move every due intersection to its next phase, green turns yellow and yellow turns the next signal green
+        """
+        updates = {}
+        starting = []
+        for deadline, intersection_id, cycle in due:
+            phase_lag_seconds.observe(now - deadline)
+            # After a long stall restart the timing from now instead of rushing through the missed phases
+            start = deadline if now - deadline < 1.0 else now
+            if cycle.phase == "Green":
+                cycle.phase = "Yellow"
+                updates[cycle.signal_ids[cycle.index]] = {"status": "Yellow"}
+                heapq.heappush(self.heap, (start + self.yellow, intersection_id, cycle.generation))
+            else:
+                cycle.index = (cycle.index + 1) % len(cycle.signal_ids)
+                cycle.phase = "Green"
+                starting.append((start, intersection_id, cycle))
+
+        if starting:
+            states = await asyncio.to_thread(
+                self.store.get_many, [signal_id for _, _, cycle in starting for signal_id in cycle.signal_ids]
+            )
+            groups = [[states.get(signal_id) for signal_id in cycle.signal_ids] for _, _, cycle in starting]
+            counts, mask = self.timing.pack([[s["vehicle_count"] if s else 0 for s in group] for group in groups])
+            ambulance, _ = self.timing.pack([[bool(s and s["ambulance_count"] > 0) for s in group] for group in groups])
+            # The cycle is stored on every signal of the intersection, None leaves it to Webster
+            cycles = [
+                next((s["cycle"] for s in group if s and s.get("cycle") is not None), math.nan) for group in groups
+            ]
+            _, greens = self.timing.plan(counts, ambulance.astype(bool), mask, cycle=cycles)
+            for row, (start, intersection_id, cycle) in enumerate(starting):
+                for i, signal_id in enumerate(cycle.signal_ids):
+                    if states.get(signal_id) is not None:
+                        updates[signal_id] = {
+                            "status": "Green" if i == cycle.index else "Red", "timing": int(greens[row, i])
+                        }
+                green = max(float(greens[row, cycle.index]), 1.0)
+                heapq.heappush(self.heap, (start + green, intersection_id, cycle.generation))
+
+        if updates:
+            await asyncio.to_thread(self.store.update_many, updates)
+
+    def status(self):
+        return {
+            "intersections": len(self.cycles),
+            "next_change_in": max(self.heap[0][0] - asyncio.get_running_loop().time(), 0) if self.heap else None,
+        }
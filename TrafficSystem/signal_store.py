@@ -0,0 +1,324 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+from types import SimpleNamespace
+
+logger = logging.getLogger(__name__)
+
+
+class SignalDatabase:
+    """
+    SQLite database in WAL mode persisting the intersection registry and the latest state of every signal.
+    Connections are opened per process, so the database can be shared by pre-forked workers.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.lock = threading.Lock()
+        self.connection = None
+        self.pid = None
+
+    def connect(self):
+        if self.connection is None or self.pid != os.getpid():
+            connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA busy_timeout=5000")
+            connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS intersections (
+                    intersection_id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS signals (
+                    signal_id INTEGER PRIMARY KEY,
+                    intersection_id INTEGER NOT NULL REFERENCES intersections (intersection_id),
+                    state TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS signals_by_intersection ON signals (intersection_id, signal_id);
+                """
+            )
+            self.connection, self.pid = connection, os.getpid()
+        return self.connection
+
+    def load(self):
+        """
+        Returns ({intersection_id: name}, {signal_id: state})
+        """
+        with self.lock:
+            connection = self.connect()
+            intersections = dict(connection.execute("SELECT intersection_id, name FROM intersections"))
+            signals = {
+                signal_id: json.loads(state)
+                for signal_id, state in connection.execute("SELECT signal_id, state FROM signals")
+            }
+        return intersections, signals
+
+    def save(self, intersections=None, signals=None):
+        """
+        Write {intersection_id: name} and {signal_id: state} in one transaction
+        """
+        with self.lock:
+            connection = self.connect()
+            connection.execute("BEGIN")
+            try:
+                connection.executemany(
+                    "INSERT INTO intersections (intersection_id, name) VALUES (?, ?) "
+                    "ON CONFLICT (intersection_id) DO UPDATE SET name = excluded.name",
+                    (intersections or {}).items(),
+                )
+                connection.executemany(
+                    "INSERT INTO signals (signal_id, intersection_id, state) VALUES (?, ?, ?) "
+                    "ON CONFLICT (signal_id) DO UPDATE SET intersection_id = excluded.intersection_id, "
+                    "state = excluded.state",
+                    (
+                        (signal_id, state["intersection_id"], json.dumps(state))
+                        for signal_id, state in (signals or {}).items()
+                    ),
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None and self.pid == os.getpid():
+                self.connection.close()
+            self.connection = None
+
+
+class SignalStore:
+    """
+    Registry of intersections and their signals, with the signal state read and written by every request handler.
+
+    The state is served from memory, a plain dict in a single server process or multiprocessing manager dicts shared
+    by all pre-forked workers. State changes only mark the signal dirty, flush() writes the latest state of every
+    dirty signal to the database in one transaction, so bursts of updates to a signal are coalesced into one write.
+    Reads return copies, so every change has to go through update() or pop().
+
+    Every change also stamps the signal with the next value of a store-wide sequence, so changes_since() can tell
+    which signals changed in any process, and calls the listeners of the process that made it.
+    """
+
+    def __init__(
+        self, database=None, data=None, intersections=None, dirty=None, lock=None, versions=None, sequence=None
+    ):
+        self.database = database
+        self.data = data if data is not None else {}
+        self.intersections = intersections if intersections is not None else {}  # id: {"name", "signal_ids"}
+        self.dirty = dirty if dirty is not None else {}
+        self.lock = lock if lock is not None else threading.Lock()
+        self.versions = versions if versions is not None else {}  # signal_id: sequence of its last change
+        self.sequence = sequence if sequence is not None else SimpleNamespace(value=0)  # same interface as manager.Value
+        self.listeners = []  # called with no arguments after every change made by this process
+
+    @classmethod
+    def open(cls, database, defaults):
+        """
+        Load the registry from the database, seeding it with defaults on first use.
+        defaults is {intersection_id: (name, {signal_id: state})}
+        """
+        store = cls(database)
+        intersections, signals = database.load() if database is not None else ({}, {})
+        if not intersections:
+            intersections = {intersection_id: name for intersection_id, (name, _) in defaults.items()}
+            signals = {
+                signal_id: {**state, "intersection_id": intersection_id}
+                for intersection_id, (_, states) in defaults.items()
+                for signal_id, state in states.items()
+            }
+            if database is not None:
+                database.save(intersections, signals)
+        for intersection_id, name in intersections.items():
+            store.intersections[intersection_id] = {"name": name, "signal_ids": []}
+        for signal_id, state in sorted(signals.items()):
+            store.data[signal_id] = state
+            store.intersections[state["intersection_id"]]["signal_ids"].append(signal_id)
+        return store
+
+    def share(self, manager):
+        """
+        A copy of the store living in the manager's server process, to be created before the workers are forked
+        """
+        shared = SignalStore(
+            self.database, manager.dict(), manager.dict(), manager.dict(), manager.Lock(), manager.dict(),
+            manager.Value("q", self.sequence.value),
+        )
+        with self.lock:
+            shared.data.update(self.data)
+            shared.intersections.update(self.intersections)
+            shared.dirty.update(self.dirty)
+            shared.versions.update(self.versions)
+        return shared
+
+    def __contains__(self, signal_id):
+        return signal_id in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, signal_id):
+        signal = self.data.get(signal_id)
+        return dict(signal) if signal is not None else None
+
+    # Every read of a shared store is a round trip to the manager, so reads of more signals than this copy it in one
+    BULK_READ = 32
+
+    def get_many(self, signal_ids):
+        signal_ids = list(signal_ids)
+        data = self.data.copy() if len(signal_ids) > self.BULK_READ else self.data
+        signals = {signal_id: data.get(signal_id) for signal_id in signal_ids}
+        return {signal_id: dict(signal) for signal_id, signal in signals.items() if signal is not None}
+
+    def all(self):
+        return {signal_id: dict(signal) for signal_id, signal in self.data.copy().items()}
+
+    def query(self, intersection_id=None, name=None, ambulance=None, min_vehicles=None, offset=0, limit=100):
+        """
+        Signals matching every given filter in signal id order. Returns (total matches, {signal_id: state} page)
+        """
+        if intersection_id is not None:
+            intersection = self.intersections.get(intersection_id)
+            signal_ids = intersection["signal_ids"] if intersection is not None else []
+        else:
+            signal_ids = sorted(self.data.keys())
+        if name is None and ambulance is None and min_vehicles is None:
+            # Only the requested page is read
+            return len(signal_ids), self.get_many(signal_ids[offset:offset + limit])
+
+        def matches(signal):
+            return (
+                (name is None or name.lower() in signal["name"].lower())
+                and (ambulance is None or (signal["ambulance_count"] > 0) == ambulance)
+                and (min_vehicles is None or signal["vehicle_count"] >= min_vehicles)
+            )
+
+        matched = [(signal_id, signal) for signal_id, signal in self.get_many(signal_ids).items() if matches(signal)]
+        return len(matched), dict(matched[offset:offset + limit])
+
+    def by_intersection(self, intersection_ids=None):
+        """
+        {intersection_id: {signal_id: state}} for the given intersections, or all of them, in signal id order
+        """
+        intersections = self.intersections.copy()
+        if intersection_ids is not None:
+            intersections = {i: intersections[i] for i in intersection_ids if i in intersections}
+        states = self.get_many([s for intersection in intersections.values() for s in intersection["signal_ids"]])
+        return {
+            intersection_id: {s: states[s] for s in intersection["signal_ids"] if s in states}
+            for intersection_id, intersection in sorted(intersections.items())
+        }
+
+    def list_intersections(self, offset=0, limit=100):
+        intersection_ids = sorted(self.intersections.keys())
+        page = intersection_ids[offset:offset + limit]
+        return len(intersection_ids), {i: dict(self.intersections[i]) for i in page}
+
+    def create_intersection(self, name, signal_names, state):
+        """
+        Register an intersection with one signal per name, each starting from a copy of state.
+        The registry change is written to the database straight away. Returns (intersection_id, {signal_id: state})
+        """
+        with self.lock:
+            intersection_id = max(self.intersections.keys(), default=0) + 1
+            first_id = max(self.data.keys(), default=0) + 1
+            signals = {
+                first_id + i: {**state, "name": signal_name, "intersection_id": intersection_id}
+                for i, signal_name in enumerate(signal_names)
+            }
+            if self.database is not None:
+                self.database.save({intersection_id: name}, signals)
+            self.data.update(signals)
+            self.intersections[intersection_id] = {"name": name, "signal_ids": list(signals)}
+            self._stamp(signals)
+        self._notify()
+        return intersection_id, signals
+
+    def update(self, signal_id, fields):
+        return self.update_many({signal_id: fields})[signal_id]
+
+    def update_many(self, updates):
+        """
+        Apply {signal_id: fields} under one lock, so readers never see half an intersection updated
+        """
+        with self.lock:
+            changed = {}
+            for signal_id, fields in updates.items():
+                signal = dict(self.data[signal_id])
+                signal.update(fields)
+                self.data[signal_id] = changed[signal_id] = signal
+            self.dirty.update(dict.fromkeys(changed, True))
+            self._stamp(changed)
+        self._notify()
+        return changed
+
+    def pop(self, signal_id, field):
+        with self.lock:
+            signal = dict(self.data[signal_id])
+            value = signal.pop(field, None)
+            self.data[signal_id] = signal
+            self.dirty[signal_id] = True
+            self._stamp([signal_id])
+        self._notify()
+        return value
+
+    def _stamp(self, signal_ids):
+        # Called with the lock held
+        self.sequence.value = sequence = self.sequence.value + 1
+        self.versions.update(dict.fromkeys(signal_ids, sequence))
+
+    def _notify(self):
+        for listener in self.listeners:
+            try:
+                listener()
+            except Exception as e:
+                logger.error(f"Signal change listener failed: {e}")
+
+    def changes_since(self, sequence):
+        """
+        Signals changed after the given sequence value, in any process. Returns (current sequence, {signal_id: state})
+        """
+        current = self.sequence.value
+        if current == sequence:
+            return current, {}
+        with self.lock:
+            current = self.sequence.value
+            changed = [signal_id for signal_id, version in self.versions.copy().items() if version > sequence]
+            return current, self.get_many(changed)
+
+    def flush(self):
+        """
+        Write the latest state of the signals changed since the last flush, returns how many were written
+        """
+        if self.database is None:
+            return 0
+        with self.lock:
+            signal_ids = list(self.dirty.keys())
+            if not signal_ids:
+                return 0
+            states = {signal_id: dict(self.data[signal_id]) for signal_id in signal_ids}
+            self.dirty.clear()
+        try:
+            self.database.save(signals=states)
+        except Exception:
+            self.dirty.update(dict.fromkeys(signal_ids, True))  # retried on the next flush
+            raise
+        return len(states)
+
+    async def run_flusher(self, interval):
+        """
+        Flush in the background every interval seconds until cancelled, then flush once more
+        """
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await asyncio.to_thread(self.flush)
+                except Exception as e:
+                    logger.error(f"Writing signal state failed: {e}")
+        finally:
+            self.flush()
@@ -0,0 +1,205 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class StreamReader(threading.Thread):
+    """
+    Keeps the most recent frame of one camera stream, reconnecting when the stream drops.
+    Frames are only decoded at the sampling rate, and local video files are paced at their own
+    frame rate and looped so they can stand in for a live camera.
+    """
+
+    def __init__(self, url, sample_interval, reconnect_delay=5.0):
+        super().__init__(daemon=True)
+        self.url = url
+        self.sample_interval = sample_interval
+        self.reconnect_delay = reconnect_delay
+        self.lock = threading.Lock()
+        self.frame = None
+        self.frame_id = 0
+        self.connected = False
+        self.stopped = threading.Event()
+
+    def run(self):
+        import cv2
+
+        is_file = os.path.isfile(self.url)
+        while not self.stopped.is_set():
+            cap = cv2.VideoCapture(self.url)
+            if not cap.isOpened():
+                logger.warning(f"Could not open stream {self.url}, retrying in {self.reconnect_delay}s")
+                self.stopped.wait(self.reconnect_delay)
+                continue
+
+            self.connected = True
+            frame_delay = 1 / (cap.get(cv2.CAP_PROP_FPS) or 30) if is_file else 0
+            last_sample = 0
+            while not self.stopped.is_set() and cap.grab():
+                now = time.monotonic()
+                if now - last_sample >= self.sample_interval:
+                    ok, frame = cap.retrieve()
+                    if ok:
+                        last_sample = now
+                        with self.lock:
+                            self.frame = frame
+                            self.frame_id += 1
+                if frame_delay:
+                    self.stopped.wait(frame_delay)
+            cap.release()
+            self.connected = False
+
+            if not is_file and not self.stopped.is_set():
+                logger.warning(f"Stream {self.url} ended, reconnecting in {self.reconnect_delay}s")
+                self.stopped.wait(self.reconnect_delay)
+
+    def latest(self):
+        with self.lock:
+            return self.frame_id, self.frame
+
+    def stop(self):
+        self.stopped.set()
+
+
+class StreamIngestor:
+    """
+    Samples every registered stream at a fixed rate and runs the newest frames of all streams
+    through the shared models as one batch, keeping a rolling count per signal.
+    """
+
+    def __init__(self, load_detectors, conf_thres, save_dir, sample_fps=1.0, window=10, reconnect_delay=5.0,
+                 gate=None, on_update=None):
+        self.load_detectors = load_detectors
+        self.conf_thres = conf_thres
+        self.save_dir = Path(save_dir)
+        self.interval = 1 / sample_fps
+        self.window = window
+        self.reconnect_delay = reconnect_delay
+        # Optional MotionGate, samples of an unchanged scene reuse the previous counts instead of being inferred
+        self.gate = gate
+        # Called on the event loop as on_update(signal_id, vehicle_count, ambulance_count, image_path) for every
+        # sample, with image_path None when the motion gate skipped it and the last image still applies
+        self.on_update = on_update
+        self.loop = None
+        self.lock = threading.Lock()
+        self.readers = {}
+        self.samples = {}
+        self.last_frame_ids = {}
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self, loop):
+        self.loop = loop
+
+    def add(self, signal_id, url):
+        self.remove(signal_id)
+        reader = StreamReader(url, self.interval, self.reconnect_delay)
+        reader.start()
+        with self.lock:
+            self.readers[signal_id] = reader
+            self.samples[signal_id] = deque(maxlen=self.window)
+        # The models are only loaded in this process once the first stream is registered
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        logger.info(f"Ingesting stream {url} for signal {signal_id}")
+
+    def remove(self, signal_id):
+        with self.lock:
+            reader = self.readers.pop(signal_id, None)
+            self.samples.pop(signal_id, None)
+            self.last_frame_ids.pop(signal_id, None)
+            if self.gate is not None:
+                self.gate.forget(signal_id)
+        if reader is not None:
+            reader.stop()
+        return reader is not None
+
+    def status(self):
+        with self.lock:
+            streams = {
+                signal_id: {
+                    "url": reader.url,
+                    "connected": reader.connected,
+                    "frames_sampled": reader.frame_id,
+                    "rolling_counts": self._rolling(self.samples[signal_id]),
+                }
+                for signal_id, reader in self.readers.items()
+            }
+        return {"streams": streams, "motion_gate": self.gate.stats() if self.gate is not None else None}
+
+    def stop(self):
+        self.stopped.set()
+        for signal_id in list(self.readers):
+            self.remove(signal_id)
+
+    @staticmethod
+    def _rolling(samples):
+        # Vehicles are averaged over the window, an ambulance seen anywhere in the window still counts
+        if not samples:
+            return {"vehicle_count": 0, "ambulance_count": 0}
+        return {
+            "vehicle_count": round(sum(v for v, _ in samples) / len(samples)),
+            "ambulance_count": max(a for _, a in samples),
+        }
+
+    def _run(self):
+        detectors = self.load_detectors()
+        next_tick = time.monotonic()
+        while not self.stopped.is_set():
+            next_tick += self.interval
+            self.stopped.wait(max(0, next_tick - time.monotonic()))
+            try:
+                self._sample(detectors)
+            except Exception as e:
+                logger.error(f"Stream inference failed: {e}")
+
+    def _sample(self, detectors):
+        batch = []
+        skipped = []
+        with self.lock:
+            for signal_id, reader in self.readers.items():
+                frame_id, frame = reader.latest()
+                if frame is not None and frame_id != self.last_frame_ids.get(signal_id):
+                    self.last_frame_ids[signal_id] = frame_id
+                    samples = self.samples[signal_id]
+                    if self.gate is not None and samples and not self.gate.changed(frame, key=signal_id):
+                        samples.append(samples[-1])
+                        skipped.append((signal_id, self._rolling(samples)))
+                        continue
+                    batch.append((signal_id, frame))
+        # A static scene still reports in, so a live camera can be told apart from a dead stream
+        for signal_id, counts in skipped:
+            self._update(signal_id, counts, None)
+        if not batch:
+            return
+
+        from yolo_module import detect_frames
+
+        vehicles, ambulances = detect_frames(
+            detectors,
+            [frame for _, frame in batch],
+            paths=[f"signal_{signal_id}.jpg" for signal_id, _ in batch],
+            save_dirs=[self.save_dir / "vehicles", self.save_dir / "ambulance"],
+            conf_thres=self.conf_thres,
+        )
+        for (signal_id, _), vehicle_detections, ambulance_detections in zip(batch, vehicles, ambulances):
+            with self.lock:
+                samples = self.samples.get(signal_id)
+                if samples is None:
+                    continue  # stream removed while inferring
+                samples.append((len(vehicle_detections), len(ambulance_detections)))
+                counts = self._rolling(samples)
+            detections = ambulance_detections if len(ambulance_detections) else vehicle_detections
+            self._update(signal_id, counts, detections.save_paths[0])
+
+    def _update(self, signal_id, counts, image_path):
+        if self.on_update is not None and self.loop is not None:
+            self.loop.call_soon_threadsafe(
+                self.on_update, signal_id, counts["vehicle_count"], counts["ambulance_count"], image_path
+            )
@@ -1,53 +1,260 @@
+import json
+import logging
 import os
-import pandas as pd
+import sys
+import time
+import uuid
+import cv2
+import numpy as np
 from pathlib import Path
-import platform
 
-def vehicle_count(csv_path, input_type):
+from config import YOLOV5_DIR, RUNS_DIR, VEHICLE_WEIGHTS, AMBULANCE_WEIGHTS, IMG_SIZE, CONF_THRES, DEVICE
+from config import MOTION_GATE_THRESHOLD, MOTION_GATE_MAX_SKIP
+from config import TILE_SIZE, TILE_OVERLAP, TILE_REGION, TILE_BATCH
+
+# detect.py imports the YOLOv5 `models` and `utils` packages from the cloned repository
+if str(YOLOV5_DIR) not in sys.path:
+    sys.path.append(str(YOLOV5_DIR))
+
+from detect import Detector, detect_shared, detect_tiled
+import metrics
+from frame_counts import FrameCountAggregator
+from motion_gate import MotionGate
+
+logger = logging.getLogger(__name__)
+
+# Detectors are loaded once per process and reused for every request
+vehicle_detector = None
+ambulance_detector = None
+vehicle_weights_path = VEHICLE_WEIGHTS
+ambulance_weights_path = AMBULANCE_WEIGHTS
+
+# Model label of each detector returned by load_detectors, for the stage metrics
+MODEL_LABELS = ("vehicle", "ambulance")
+
+def stage_timer(stage, i=None):
+    return metrics.timed(stage, MODEL_LABELS[i] if i is not None else "")
+
+def detect_frames(detectors, im0s, paths, save_dirs, conf_thres=CONF_THRES):
+    """
+    Run the detectors over decoded frames, tiling high-resolution frames when TILE_SIZE is set
+    """
+    if TILE_SIZE > 0:
+        return detect_tiled(
+            detectors,
+            im0s,
+            paths=paths,
+            save_dirs=save_dirs,
+            tile_size=TILE_SIZE,
+            overlap=TILE_OVERLAP,
+            region=TILE_REGION,
+            tile_batch=TILE_BATCH,
+            conf_thres=conf_thres,
+            stage_timer=stage_timer,
+        )
+    return detect_shared(
+        detectors, im0s, paths=paths, save_dirs=save_dirs, conf_thres=conf_thres, stage_timer=stage_timer
+    )
+
+def vehicle_count(result, input_type, names=None):
     if input_type == 'Image':
-        df = pd.read_csv(csv_path, header=None)
-        df.columns = ['File', 'Vehicle_Type', 'Confidence']
-        return df.shape[0]
+        return len(result)
     elif input_type == 'Video':
-        df = pd.read_csv(csv_path, header=None)
-        # Get columns of df
-        print(df.columns)
-        df.columns = ['File', 'Vehicle_Type', 'Confidence', 'Frame']
-        df = df.groupby(['Frame', 'Vehicle_Type']).size().reset_index(name='Count')
-        df = df.groupby('Vehicle_Type')['Count'].mean().reset_index()
-        df['Count'] = df['Count'].astype(int)
-        return df
-
-def run_command(command):
-    if platform.system() == "Windows":
-        os.system(command.replace("/", "\\"))
-    else:
-        os.system(command)
+        # result is a FrameCountAggregator, mean count per class over the frames the class appears in
+        means = result.means(present_only=True)
+        return {names[c]: int(means[c]) for c in np.flatnonzero(result.present)}
+
+def configure_weights(vehicle_weights, ambulance_weights):
+    """
+    Use other model files than the configured .pt weights, e.g. an exported ONNX or OpenVINO model
+    """
+    global vehicle_weights_path, ambulance_weights_path
+    vehicle_weights_path, ambulance_weights_path = vehicle_weights, ambulance_weights
+
+def load_detectors():
+    """
+    Load the vehicle and ambulance models if they are not resident yet
+    """
+    global vehicle_detector, ambulance_detector
+    if vehicle_detector is None:
+        vehicle_detector = Detector(vehicle_weights_path, imgsz=(IMG_SIZE, IMG_SIZE), device=DEVICE)
+    if ambulance_detector is None:
+        ambulance_detector = Detector(ambulance_weights_path, imgsz=(IMG_SIZE, IMG_SIZE), device=DEVICE)
+    return vehicle_detector, ambulance_detector
+
+def new_run_dir():
+    """
+    Unique output directory for one request, known before detection starts
+    """
+    return Path(RUNS_DIR) / f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
 
 def num_vehicles(img_path):
-    run_command(f"python ../yolov5/detect.py --weights ../best.pt --img 640 --conf 0.4 --save-csv --source {img_path}")
-    latest_exp = sorted(Path('../yolov5/runs/detect').glob('exp*'), key=os.path.getmtime)[-1]
+    detector, _ = load_detectors()
+    run_dir = new_run_dir()
+    detections = detector.run(source=img_path, conf_thres=CONF_THRES, project=run_dir.parent, name=run_dir.name, exist_ok=True)
     # For counting vehicles in image
-    filenames = [f for f in os.listdir(latest_exp) if f.endswith('.csv')]
-    count = vehicle_count(f"{latest_exp}/{filenames[0]}", 'Image')
+    count = vehicle_count(detections, 'Image')
 
     # For detecting vehicles in Image
-    detect_vehicle_file = [f for f in os.listdir(latest_exp) if f.endswith(('.jpeg', '.jpg'))][0]
-    print("detect_vehicle_count", detect_vehicle_file, count)
-    return count, f"{latest_exp}/{detect_vehicle_file}"
+    detect_vehicle_file = detections.save_paths[0]
+    logger.debug(f"Counted {count} vehicles in {detect_vehicle_file}")
+    return count, detect_vehicle_file
 
 def ambulance_detection(img_path):
-    run_command(f"python ../yolov5/detect.py --weights ../er_best.pt --img 640 --conf 0.4 --save-csv --source {img_path}")
-    latest_exp = sorted(Path('../yolov5/runs/detect').glob('exp*'), key=os.path.getmtime)[-1]
-    filenames = [f for f in os.listdir(latest_exp) if f.endswith('.csv')]
-    if len(filenames) == 0:
-        print("No Ambulance Detected")
+    _, detector = load_detectors()
+    run_dir = new_run_dir()
+    detections = detector.run(source=img_path, conf_thres=CONF_THRES, project=run_dir.parent, name=run_dir.name, exist_ok=True)
+    if len(detections) == 0:
+        logger.debug("No ambulance detected")
         return 0, None
     
-    count = vehicle_count(f"{latest_exp}/{filenames[0]}", 'Image')
-    ambulance_detect_vehicle_file = [f for f in os.listdir(latest_exp) if f.endswith(('.jpeg', '.jpg'))][0]
-    print("Ambulance detect_vehicle_count", ambulance_detect_vehicle_file, count)
-    return count, f"{latest_exp}/{ambulance_detect_vehicle_file}"
+    count = vehicle_count(detections, 'Image')
+    ambulance_detect_vehicle_file = detections.save_paths[0]
+    logger.debug(f"Counted {count} ambulances in {ambulance_detect_vehicle_file}")
+    return count, ambulance_detect_vehicle_file
+
+def write_progress(progress_path, stats):
+    """
+    Replace a job's progress file in one step, so the server never reads a half-written snapshot
+    """
+    partial = f"{progress_path}.partial"
+    with open(partial, "w") as f:
+        json.dump(stats, f)
+    os.replace(partial, progress_path)
+
+def count_video(video_path, progress_path=None, progress_every=30):
+    """
+    Count vehicles in a video as frames are produced, without keeping per-box results.
+    The running statistics are written to progress_path every progress_every frames, for the job's status view.
+    Returns (vehicle_count per class, stats, annotated video path)
+    """
+    detector, _ = load_detectors()
+    aggregator = FrameCountAggregator(len(detector.names))
+    gate = MotionGate(MOTION_GATE_THRESHOLD, max_skip=MOTION_GATE_MAX_SKIP) if MOTION_GATE_THRESHOLD > 0 else None
+
+    def video_stats():
+        stats = aggregator.stats(detector.names)
+        stats["motion_gate"] = gate.stats() if gate is not None else None
+        return stats
+
+    def on_frame(frame, det):
+        aggregator.update(det[:, 5].astype(np.int64))
+        if progress_path is not None and aggregator.frames % progress_every == 0:
+            write_progress(progress_path, video_stats())
+
+    run_dir = new_run_dir()
+    detections = detector.run(
+        source=video_path,
+        conf_thres=CONF_THRES,
+        project=run_dir.parent,
+        name=run_dir.name,
+        exist_ok=True,
+        on_frame=on_frame,
+        keep_results=False,
+        gate=gate,
+    )
+    counts = vehicle_count(aggregator, 'Video', names=detector.names)
+    return counts, video_stats(), detections.save_paths[0] if detections.save_paths else None
+
+def decode_image(contents):
+    """
+    Decode encoded image bytes (jpeg, png, ...) into a BGR array without touching the filesystem
+    """
+    im0 = cv2.imdecode(np.frombuffer(contents, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if im0 is None:
+        raise ValueError("Could not decode image")
+    return im0
+
+def crop_to_roi(im0, roi):
+    """
+    Crop a frame to the bounding rectangle of a signal's lane polygons and grey out the pixels outside every lane.
+    roi is {"lanes": [{"name", "points": [[x, y], ...]}]} with points as fractions of the frame width and height.
+    Returns the crop and the lane polygons in crop pixels as (name, points) pairs
+    """
+    h, w = im0.shape[:2]
+    lanes = [
+        (lane["name"], np.round(np.asarray(lane["points"], dtype=np.float64) * [w, h]).astype(np.int32))
+        for lane in roi["lanes"]
+    ]
+    points = np.concatenate([polygon for _, polygon in lanes])
+    x0, y0 = np.clip(points.min(axis=0), 0, [w - 1, h - 1])
+    x1, y1 = np.clip(points.max(axis=0) + 1, [x0 + 1, y0 + 1], [w, h])
+    crop = im0[y0:y1, x0:x1]
+    lanes = [(name, polygon - [x0, y0]) for name, polygon in lanes]
+    mask = np.zeros(crop.shape[:2], dtype=np.uint8)
+    cv2.fillPoly(mask, [polygon for _, polygon in lanes], 255)
+    crop = np.where(mask[..., None] > 0, crop, np.uint8(114))  # the grey letterbox pads with
+    return crop, lanes
+
+def lane_counts(detections, lanes):
+    """
+    Boxes per lane, a box belongs to the first lane containing the middle of its bottom edge where it meets the road.
+    Returns ({lane name: count}, number of boxes in any lane)
+    """
+    counts = dict.fromkeys((name for name, _ in lanes), 0)
+    for x0, y0, x1, y1 in detections.boxes:
+        point = (float(x0 + x1) / 2, float(y1))
+        for name, polygon in lanes:
+            if cv2.pointPolygonTest(polygon.reshape(-1, 1, 2), point, False) >= 0:
+                counts[name] += 1
+                break
+    return counts, sum(counts.values())
+
+def detect_uploads(uploads):
+    """
+    Run both models over uploaded images held in memory, given as (filename, bytes) or (filename, bytes, roi).
+    With a roi only the signal's lanes are inferred and counted.
+    Returns a (vehicle_count, vehicle_image, ambulance_count, ambulance_image, lane_counts) tuple per image, or the
+    ValueError of an image that could not be decoded so the rest of a batch still gets its results
+    """
+    results = [None] * len(uploads)
+    im0s, names, lanes, slots = [], [], [], []
+    for i, upload in enumerate(uploads):
+        try:
+            with stage_timer("decode"):
+                im0 = decode_image(upload[1])
+            roi = upload[2] if len(upload) > 2 else None
+            upload_lanes = None
+            if roi:
+                with stage_timer("roi"):
+                    im0, upload_lanes = crop_to_roi(im0, roi)
+        except ValueError as e:
+            results[i] = e
+            continue
+        im0s.append(im0)
+        names.append(upload[0])
+        lanes.append(upload_lanes)
+        slots.append(i)
+    if im0s:
+        for i, result in zip(slots, detect_images(im0s, names, lanes)):
+            results[i] = result
+    return results
+
+def detect_images(im0s, names, lanes=None):
+    """
+    Run both models over decoded BGR images, names are used for the annotated output files.
+    lanes optionally holds the (name, polygon) lane pairs of each image from crop_to_roi, to count per lane.
+    Returns a (vehicle_count, vehicle_image, ambulance_count, ambulance_image, lane_counts) tuple per image,
+    lane_counts is None for images without lanes
+    """
+    detectors = load_detectors()
+    save_dir = new_run_dir()
+    vehicles, ambulances = detect_frames(
+        detectors, im0s, paths=names, save_dirs=[save_dir / 'vehicles', save_dir / 'ambulance']
+    )
+
+    results = []
+    for vehicle_detections, ambulance_detections, image_lanes in zip(vehicles, ambulances, lanes or [None] * len(im0s)):
+        if image_lanes:
+            counts, count = lane_counts(vehicle_detections, image_lanes)
+            _, ambulance_count = lane_counts(ambulance_detections, image_lanes)
+        else:
+            counts, count, ambulance_count = None, len(vehicle_detections), len(ambulance_detections)
+        vehicle_image = vehicle_detections.save_paths[0]
+        ambulance_image = ambulance_detections.save_paths[0] if ambulance_count > 0 else None
+        logger.debug(f"Counted {count} vehicles and {ambulance_count} ambulances in {vehicle_image}")
+        results.append((count, vehicle_image, ambulance_count, ambulance_image, counts))
+    return results
 
 # Example usage
 if __name__ == "__main__":